@@ -1,25 +1,44 @@
-from io import BytesIO
+import asyncio
+from collections import Counter
+from dataclasses import dataclass
 import json
-from fastapi import APIRouter, Depends, File, HTTPException, UploadFile, Form, Body, Query
-from fastapi.responses import FileResponse, JSONResponse
-import os
-from PIL import Image
+from fastapi import APIRouter, Depends, File, HTTPException, Request, Response, UploadFile, Form, Body, Query
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
+import random
 import secrets
-from sqlalchemy import func
+from typing import List, Optional, Union
+from pydantic import ValidationError
+from sqlalchemy import insert, select
 from sqlalchemy.orm import Session
 from sqlalchemy.exc import SQLAlchemyError
 from datetime import datetime, timedelta, timezone
 import logging
 
-from app.auth import check_password, create_email_token, decode_verification_token, get_current_user, hash_password
-from app.celery import process_image_task
-from app.database import get_db
-from app.models import Image as ImageModel, ImageAccessRequest, ImageUploadRequest, LoginRequest, PasswordResetEmailRequest, PasswordResetRequest, RegisterRequest, User, VerifyRequest, mime_types, MessageResponse, UploadResponse
-from app.rate_limiter import limit
-from app.email import send_password_reset_email, send_register_email
-from app.validators import validate_email, validate_password, validate_username
+from app.auth import IMAGE_GRANT_COOKIE, IMAGE_GRANT_SECONDS, Principal, check_password_and_update, create_email_token, create_image_grant, decode_verification_token, get_current_user, has_image_grant, hash_password, invalidate_sessions
+from app.blobs import add_ref, original_key, processed_key, try_add_ref
+from app.celery import dispatch_batches, mark_dispatched, process_image_task, queue_for_cost, send_email_task
+from app.database import SessionLocal, after_commit, get_db
+from app.derivatives import DERIVATIVE_WIDTHS, derivative_key, lazy_derivative, responsive_width
+from app.image_cache import ImageMeta, get_image_meta, invalidate_images
+from app.image_status import STATUS_RECONNECT_SECONDS, status_event, status_hub, wait_for_status
+from app.http_cache import cache_max_age, http_date, image_etag, is_not_modified, public_cache_control, requested_range
+from app.models import Image as ImageModel, ImageAccessRequest, ImageUploadRequest, LoginRequest, PasswordResetEmailRequest, PasswordResetRequest, RegisterRequest, User, VerifyRequest, mime_types, BatchUploadItem, BatchUploadResponse, MessageResponse, UploadResponse
+from app.rate_limiter import limit, limit_by_ip
+from app.storage import RangeNotSatisfiable, resolve_range, storage
+from app.uploads import MAX_BATCH_FILES, probe_image, read_upload, store_original
+from app.executor import call_hash, run_cpu, run_hash
+from app.metrics import UPLOAD_BYTES
+from app.formats import DEFAULT_PROFILE, PROFILES, SAVE_FORMATS, negotiate_format, save_format_for, variant_key
+from app.pipeline import estimate_cost_ms
+from app.email import password_reset_email, register_email
 
 RANDOM_IMAGES_LIMIT = 5
+RANDOM_SAMPLE_WINDOW = 4
+
+# image/jpg is not a registered type but some clients still send it
+UPLOAD_CONTENT_TYPES = {"image/jpg"} | {mime_types[ext] for ext in SAVE_FORMATS}
+FORMATS_DETAIL = ", ".join(ext.upper() for ext in SAVE_FORMATS)
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -27,49 +46,228 @@ logger = logging.getLogger(__name__)
 router = APIRouter()
 
 @router.get("/testauth", tags=["test"])
-async def test(_: User = Depends(get_current_user)):
+async def test(_: Principal = Depends(get_current_user)):
     return MessageResponse(message="Logged in")
 
 
-@router.post("/images/{image_id}", tags=["images"])
-async def get_image(image_id: str, data: ImageAccessRequest = Body(...), db: Session = Depends(get_db)):
-    image_model = db.query(ImageModel).filter_by(id=image_id).first()
-    if not image_model:
-        raise HTTPException(status_code=404, detail="Image not found")
+def range_not_satisfiable(size: int):
+    return Response(status_code=416, headers={"Content-Range": f"bytes */{size}"})
+
+
+# single byte ranges are answered with a 206 so interrupted downloads resume where they stopped
+def byte_range(request: Request, headers: dict):
+    return requested_range(request, headers.get("ETag"), headers.get("Last-Modified"))
+
+
+# local files go out through FileResponse (ranges and pathsend included) or, behind caddy, as an
+# internal redirect it serves itself, remote objects are streamed through in chunks
+def stored_file_response(request: Request, key: str, ext: str, headers: Optional[dict]):
+    media_type = mime_types.get(ext, "application/octet-stream")
+    headers = dict(headers or {})
+
+    uri = storage.accel_uri(key)
+    if uri:
+        headers["X-Accel-Redirect"] = uri
+        return Response(media_type=media_type, headers=headers)
+
+    path = storage.local_path(key)
+    if path:
+        return FileResponse(path=path, media_type=media_type, headers=headers)
+
+    headers["Accept-Ranges"] = "bytes"
+    span = byte_range(request, headers)
+    if span is None:
+        return StreamingResponse(storage.iter_chunks(key), media_type=media_type, headers=headers)
+
+    try:
+        start, end, size, chunks = storage.open_range(key, *span)
+    except RangeNotSatisfiable as e:
+        return range_not_satisfiable(e.size)
+
+    headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    headers["Content-Length"] = str(end - start + 1)
+    return StreamingResponse(chunks, status_code=206, media_type=media_type, headers=headers)
+
+
+def bytes_response(request: Request, content: bytes, ext: str, headers: Optional[dict]):
+    media_type = mime_types.get(ext, "application/octet-stream")
+    headers = dict(headers or {}, **{"Accept-Ranges": "bytes"})
 
-    if image_model.protected:
-        if not data.password or not check_password(data.password, image_model.hashed_password):
-            raise HTTPException(status_code=401, detail="Invalid password to protected image")
+    span = byte_range(request, headers)
+    if span is None:
+        return Response(content=content, media_type=media_type, headers=headers)
+
+    try:
+        start, end = resolve_range(*span, len(content))
+    except RangeNotSatisfiable as e:
+        return range_not_satisfiable(e.size)
+
+    headers["Content-Range"] = f"bytes {start}-{end}/{len(content)}"
+    return Response(content=content[start:end + 1], status_code=206, media_type=media_type, headers=headers)
+
+
+# the processed image or one of its smaller variants, in the format negotiated from accept
+def processed_response(request: Request, meta: ImageMeta, ext: str, headers: Optional[dict]):
+    key = meta.processed_key if ext == meta.ext else variant_key(meta.processed_key, ext)
+    return stored_file_response(request, key, ext, headers)
+
+
+# the worker's derivatives come from storage, other widths from the api's disk cache
+def derivative_response(request: Request, meta: ImageMeta, width: int, ext: str, headers: dict):
+    key = derivative_key(meta.processed_key, width)
+    if ext != meta.ext:
+        key = variant_key(key, ext)
+    if width in DERIVATIVE_WIDTHS and storage.exists(key):
+        return stored_file_response(request, key, ext, headers)
+
+    content = lazy_derivative(meta.processed_key, width, ext, meta.encode_profile)
+    return bytes_response(request, content, ext, headers)
 
 
-    ext = image_model.format.lower().strip()
-    image_path = os.path.join("storage", "processed", f"{image_id}.{ext}")
+# for handlers that answer with a stream, a get_db session would hold its pooled connection
+# until the last byte is sent, this one is returned before the response is built
+def read_image_meta(image_id: str) -> Optional[ImageMeta]:
+    with SessionLocal() as db:
+        return get_image_meta(db, image_id)
+
+
+# the grant cookie only goes back to this image's own urls
+def set_image_grant(response: Response, image_id: str):
+    response.set_cookie(
+        key=IMAGE_GRANT_COOKIE,
+        value=create_image_grant(image_id),
+        httponly=True,
+        secure=True,
+        samesite="strict",
+        max_age=IMAGE_GRANT_SECONDS,
+        path=f"/images/{image_id}",
+    )
 
-    if not os.path.exists(image_path):
+
+# a failed upgrade only means the old hash is checked again next time
+def rehash_image_password(db: Session, image_id: str, new_hash: str):
+    try:
+        db.query(ImageModel).filter_by(id=image_id).update({"hashed_password": new_hash})
+        db.commit()
+    except SQLAlchemyError as db_e:
+        logger.warning(f"Password rehash failed for image {image_id}: {db_e}")
+        db.rollback()
+
+
+@router.post("/images/{image_id}", tags=["images"])
+def get_image(image_id: str, request: Request, data: ImageAccessRequest = Body(...)):
+    # the session is closed before a remote object is streamed, see read_image_meta
+    with SessionLocal() as db:
+        meta = get_image_meta(db, image_id)
+        if not meta:
+            raise HTTPException(status_code=404, detail="Image not found")
+
+        # a valid grant from an earlier correct password skips the hash check
+        granted = meta.protected and has_image_grant(request, image_id)
+        if meta.protected and not granted:
+            # the hash is never cached, only read when a password is actually checked
+            hashed_password = db.query(ImageModel.hashed_password).filter_by(id=image_id).scalar() if data.password else None
+            valid, new_hash = call_hash(check_password_and_update, data.password, hashed_password) if hashed_password else (False, None)
+            if not valid:
+                raise HTTPException(status_code=401, detail="Invalid password to protected image")
+
+            if new_hash:
+                rehash_image_password(db, image_id, new_hash)
+
+    if meta.status == "FAILED":
+        raise HTTPException(status_code=422, detail="Image processing failed")
+    if meta.last_modified is None:
         raise HTTPException(status_code=404, detail="Image not processed yet")
 
-    return FileResponse(path=image_path, media_type=mime_types.get(ext, "application/octet-stream"))
+    ext = negotiate_format(request.headers.get("accept"), meta.variants, meta.ext, mime_types)
+
+    # password checked responses must never land in a shared cache
+    headers = {"Vary": "Accept"}
+    if meta.protected:
+        headers["Cache-Control"] = "private, no-store"
+    response = processed_response(request, meta, ext, headers)
+
+    if meta.protected and not granted:
+        set_image_grant(response, image_id)
+    return response
+
+# random keyset probing, ids are random tokens so the rows at or after a random token are
+# a random slice of the partial index, sampling from a window of them evens out the bias
+# towards ids that follow a large gap
+def sample_public_image_ids(db: Session, count: int) -> list:
+    public = (ImageModel.protected == False, ImageModel.status == "COMPLETED")
+    window = count * RANDOM_SAMPLE_WINDOW
+
+    ids = list(db.execute(
+        select(ImageModel.id).where(ImageModel.id >= secrets.token_urlsafe(6), *public).order_by(ImageModel.id).limit(window)
+    ).scalars())
+
+    # the window ran past the largest id, wrap around to the start
+    if len(ids) < window:
+        wrapped = db.execute(select(ImageModel.id).where(*public).order_by(ImageModel.id).limit(window - len(ids))).scalars()
+        ids = list(dict.fromkeys(ids + list(wrapped)))
+
+    return random.sample(ids, min(count, len(ids)))
 
 @router.get("/images/random", tags=["images"])
-async def get_random_images(db: Session = Depends(get_db)):
-    images = db.query(ImageModel).filter(ImageModel.protected == False, ImageModel.status == "COMPLETED").order_by(func.random()).limit(RANDOM_IMAGES_LIMIT).all()
-    
-    if not images or len(images) != RANDOM_IMAGES_LIMIT:
-        raise HTTPException(status_code=404, detail="No images found")
+def get_random_images(db: Session = Depends(get_db)):
+    image_ids = sample_public_image_ids(db, RANDOM_IMAGES_LIMIT)
+
+    # fewer than the limit (or none) is a normal answer on a fresh instance
+    return [{"id": image_id} for image_id in image_ids]
+
+# cacheable variant for public images, browsers and caddy can revalidate with a 304,
+# ?w= asks for a copy at most that wide
+@router.get("/images/{image_id}", tags=["images"])
+def get_public_image(image_id: str, request: Request, w: Optional[int] = Query(None, ge=1)):
+    meta = read_image_meta(image_id)
+    if not meta:
+        raise HTTPException(status_code=404, detail="Image not found")
 
-    return [{"id": image.id} for image in images]
+    # protected images only with a grant from the password checked POST, and never from a shared cache
+    if meta.protected and not has_image_grant(request, image_id):
+        raise HTTPException(status_code=401, detail="Invalid password to protected image")
 
-@router.post("/upload", tags=["upload"])
-async def upload_image(
-        file: UploadFile = File(...),
-        options: str = Form(...),
-        user: User = Depends(get_current_user),
-        db: Session = Depends(get_db)
-):
-    limit(user.email)
+    if meta.status == "FAILED":
+        raise HTTPException(status_code=422, detail="Image processing failed", headers={"Cache-Control": "no-store"})
+    if meta.last_modified is None:
+        raise HTTPException(status_code=404, detail="Image not processed yet", headers={"Cache-Control": "no-store"})
 
-    data = ImageUploadRequest(**json.loads(options))
+    width = responsive_width(w) if w else None
+    # nothing narrower than the image exists at that width, the processed image is the answer
+    if width and meta.pixel_width and width >= meta.pixel_width:
+        width = None
+    ext = negotiate_format(request.headers.get("accept"), meta.variants, meta.ext, mime_types)
+
+    # each width and format is its own representation, caches key them on accept too
+    variant = ".".join(part for part in (f"w{width}" if width else None, ext if ext != meta.ext else None) if part)
+    etag = image_etag(meta.id, meta.format, meta.filters, meta.width, meta.height, variant or None)
+    headers = {
+        "ETag": etag,
+        "Last-Modified": http_date(meta.last_modified),
+        "Cache-Control": "private, no-store" if meta.protected else public_cache_control(cache_max_age(meta.expires_at)),
+        "Vary": "Accept",
+    }
+
+    if is_not_modified(request, etag, meta.last_modified):
+        return Response(status_code=304, headers=headers)
+
+    if width:
+        return derivative_response(request, meta, width, ext, headers)
+
+    return processed_response(request, meta, ext, headers)
 
+@dataclass
+class PreparedUpload:
+    row: dict
+    content: bytes
+    save_format: str
+    source_format: str
+    cost_ms: float
+
+
+# validates one file against its options and stores its original, raises HTTPException on bad input
+async def prepare_upload(file: UploadFile, data: ImageUploadRequest) -> PreparedUpload:
     format = data.format
     apply_resize = data.apply_resize
     width = data.width
@@ -80,6 +278,7 @@ async def upload_image(
     apply_blur = data.apply_blur
     protected = data.protected
     password = data.password
+    profile = (data.encode_profile or DEFAULT_PROFILE).lower().strip()
 
     if protected and not password:
         raise HTTPException(status_code=400, detail="Password must be provided for protected images")
@@ -88,8 +287,8 @@ async def upload_image(
         width = None
         height = None
 
-    if file.content_type not in ["image/jpg", "image/jpeg", "image/png"]:
-        raise HTTPException(status_code=400, detail="Only JPG, JPEG, and PNG files are allowed")
+    if file.content_type not in UPLOAD_CONTENT_TYPES:
+        raise HTTPException(status_code=400, detail=f"Only {FORMATS_DETAIL} files are allowed")
     
     if apply_resize and (width is None or height is None):
         raise HTTPException(status_code=400, detail="Width and height must be given for resizing")
@@ -100,26 +299,23 @@ async def upload_image(
     if sum([apply_grayscale, apply_color_inversion, apply_sepia, apply_blur]) > 1:
         raise HTTPException(status_code=400, detail="Only one filter can be applied at a time")
 
-    if format and format.lower() not in ["jpg", "jpeg", "png"]:
-        raise HTTPException(status_code=400, detail="Only JPG, JPEG, and PNG files are allowed")
+    if format and format.lower().strip() not in SAVE_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Only {FORMATS_DETAIL} files are allowed")
     elif not format:
         raise HTTPException(status_code=400, detail="Format must be specified")
 
+    if profile not in PROFILES:
+        raise HTTPException(status_code=400, detail=f"Encode profile must be one of {', '.join(PROFILES)}")
 
-    content = await file.read()
-   
-    if len(content) > 1000000:
-        raise HTTPException(status_code=400, detail="File size exceeds 1MB limit")
-   
-    try:
-        image = Image.open(BytesIO(content))
-        image.verify()
-        image = Image.open(BytesIO(content))
-    except Exception as e:
+
+    content = await read_upload(file)
+
+    probe = probe_image(content)
+    if not probe:
         raise HTTPException(status_code=400, detail=f"Invalid image file")
-  
 
-    width_image, height_image = image.size
+    source_format, _, (width_image, height_image) = probe
+    UPLOAD_BYTES.labels(source_format).observe(len(content))
     if width_image < 32 or height_image < 32 or width_image > 2560 or height_image > 2560:
         raise HTTPException(status_code=400, detail="Image dimensions must be between 32x32 and 2560x2560 pixels")
 
@@ -127,14 +323,13 @@ async def upload_image(
    
 
     ext = format.lower().strip()
-    if ext in ["jpg", "jpeg"] and image.mode != "RGB":
-        image = image.convert("RGB")
+    save_format = save_format_for(ext)
+
+    # identical bytes share one stored original, a re-encoded one only with the same profile
+    source_key = original_key(content, ext, profile if source_format != save_format else None)
 
     try:
-        path = os.path.join("storage", "originals", f"{image_id}.{ext}")
-        os.makedirs(os.path.dirname(path), exist_ok=True)
-        save_format = "PNG" if ext == "png" else "JPEG"
-        image.save(path, format=save_format)
+        await run_cpu(store_original, content, source_key, save_format, source_format, profile)
     except OSError as e:
         logger.error(f"Failed to save original image: {e}")
         raise HTTPException(status_code=500, detail=f"Failed to save image")
@@ -150,64 +345,244 @@ async def upload_image(
     elif apply_blur:
         filters.append("blur")
 
-    logger.info(f"Image ID: {image_id}, Filters: {filters}, Width: {width}, Height: {height} - Job sent to celery worker")
+    hashed_password = await run_hash(hash_password, password) if protected else None
+
+    row = {
+        "id": image_id,
+        "format": ext.upper(),
+        "filters": filters if filters else None,
+        "width": width if apply_resize else None,
+        "height": height if apply_resize else None,
+        "status": "PROCESSING",
+        "protected": protected,
+        "hashed_password": hashed_password,
+        "original_key": source_key,
+        "processed_key": processed_key(source_key, filters, width, height, ext, profile),
+        "encode_profile": profile,
+        # set once the message reached the broker, see dispatch_processing
+        "dispatched_at": None,
+        "attempts": 0,
+    }
+
+    target_size = (width, height) if apply_resize else None
+    cost_ms = estimate_cost_ms(filters, (width_image, height_image), target_size, save_format, profile, DERIVATIVE_WIDTHS)
+
+    return PreparedUpload(row=row, content=content, save_format=save_format, source_format=source_format, cost_ms=cost_ms)
+
+
+# one insert statement and one commit for every row, blob rows are touched in key order
+# so concurrent uploads sharing blobs cannot deadlock
+def insert_images(db: Session, uploads: list):
+    # the same original with the same options was already processed
+    outputs = Counter(upload.row["processed_key"] for upload in uploads)
+    reused = {key for key in sorted(outputs) if try_add_ref(db, key, outputs[key])}
+    for upload in uploads:
+        if upload.row["processed_key"] in reused:
+            upload.row["status"] = "COMPLETED"
+
+    db.execute(insert(ImageModel), [upload.row for upload in uploads])
+
+    sources = Counter(upload.row["original_key"] for upload in uploads)
+    for key in sorted(sources):
+        add_ref(db, key, sources[key])
+
+    # workers only ever see committed rows, no countdown needed
+    after_commit(db, lambda: dispatch_processing(uploads))
+    db.commit()
+
+
+async def save_uploads(db: Session, uploads: list):
+    try:
+        await run_in_threadpool(insert_images, db, uploads)
+        await run_in_threadpool(invalidate_images, [upload.row["id"] for upload in uploads])
+
+    except SQLAlchemyError as db_e:
+        logger.error(f"Database error: {db_e}")
+        await run_in_threadpool(db.rollback)
+        raise HTTPException(status_code=500, detail="Database error")
+
+    # a blob may have been swept by cleanup between the write and the reference being committed
+    async def restore(upload: PreparedUpload):
+        try:
+            await run_cpu(store_original, upload.content, upload.row["original_key"], upload.save_format, upload.source_format, upload.row["encode_profile"])
+        except OSError as e:
+            logger.error(f"Failed to restore original image {upload.row['original_key']}: {e}")
+
+    await asyncio.gather(*(restore(upload) for upload in uploads))
+
+
+# a single image keeps the low latency per image task on the queue for its cost, larger
+# batches go out as batch messages with the cheapest images first, rows whose message
+# is lost are picked up again by redispatch_stalled_images
+def dispatch_processing(uploads: list):
+    pending = []
+    for upload in uploads:
+        row = upload.row
+        if row["status"] == "COMPLETED":
+            logger.info(f"Image ID: {row['id']}, Filters: {row['filters']}, Width: {row['width']}, Height: {row['height']} - Reused {row['processed_key']}")
+            continue
+
+        logger.info(f"Image ID: {row['id']}, Filters: {row['filters']}, Width: {row['width']}, Height: {row['height']} - Job sent to celery worker")
+        pending.append(upload)
+
+    if not pending:
+        return
+
+    dispatched_at = datetime.now(timezone.utc)
+    if len(pending) == 1:
+        upload = pending[0]
+        row = upload.row
+        process_image_task.apply_async(
+            args=[row["id"], row["filters"] or [], row["width"] or 0, row["height"] or 0], queue=queue_for_cost(upload.cost_ms)
+        )
+    else:
+        dispatch_batches([upload.row["id"] for upload in sorted(pending, key=lambda upload: upload.cost_ms)])
+    mark_dispatched([upload.row["id"] for upload in pending], dispatched_at)
+
 
-    process_image_task.apply_async(args=[image_id, filters, width or 0, height or 0], countdown=5)
+def upload_message(upload: PreparedUpload) -> str:
+    if upload.row["status"] == "COMPLETED":
+        return "Image uploaded and processed"
+    return "Image uploaded and processing started"
 
 
+# server sent events, one event with the final status replaces polling /images/{id}
+@router.get("/images/{image_id}/status", tags=["images"])
+async def image_status_stream(image_id: str):
+    # subscribed before the status is read, so a completion in between is not missed
+    queue = status_hub.subscribe(image_id)
+
     try:
-        image_model = ImageModel(
-            id=image_id,
-            format=ext.upper(),
-            filters=filters if filters else None,
-            width=width if apply_resize else None,
-            height=height if apply_resize else None,
-            status="PROCESSING",
-            protected=protected,
-            hashed_password=hash_password(password) if protected else None,
-        )
+        meta = await run_in_threadpool(read_image_meta, image_id)
+    except Exception:
+        status_hub.unsubscribe(image_id, queue)
+        raise
 
-        db.add(image_model)
-        db.commit()
+    if not meta:
+        status_hub.unsubscribe(image_id, queue)
+        raise HTTPException(status_code=404, detail="Image not found")
 
-    except SQLAlchemyError as db_e:
-        logger.error(f"Database error: {db_e}")
-        db.rollback()
-        raise HTTPException(status_code=500, detail="Database error")
+    async def events():
+        try:
+            yield f"retry: {STATUS_RECONNECT_SECONDS * 1000}\n\n"
+
+            # a client that connects or reconnects after the worker finished gets the stored outcome
+            if meta.last_modified is not None:
+                yield status_event(image_id, "COMPLETED")
+                return
+            if meta.status == "FAILED":
+                yield status_event(image_id, "FAILED")
+                return
+
+            async for status in wait_for_status(queue):
+                yield status_event(image_id, status) if status else ": keepalive\n\n"
+        finally:
+            status_hub.unsubscribe(image_id, queue)
 
-    return UploadResponse(image_id=image_id, message="Image uploaded and processing started")
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-store", "X-Accel-Buffering": "no"})
+
+
+@router.post("/upload", tags=["upload"])
+async def upload_image(
+        request: Request,
+        file: UploadFile = File(...),
+        options: str = Form(...),
+        user: Principal = Depends(get_current_user),
+        db: Session = Depends(get_db)
+):
+    await run_in_threadpool(limit, request, "upload", user.email)
+
+    data = ImageUploadRequest(**json.loads(options))
+    upload = await prepare_upload(file, data)
+
+    await save_uploads(db, [upload])
+
+    return UploadResponse(image_id=upload.row["id"], message=upload_message(upload))
+
+
+# options is a json list with one entry per file, a bad file only fails its own item
+@router.post("/upload/batch", tags=["upload"])
+async def upload_images(
+        request: Request,
+        files: List[UploadFile] = File(...),
+        options: str = Form(...),
+        user: Principal = Depends(get_current_user),
+        db: Session = Depends(get_db)
+):
+    if len(files) > MAX_BATCH_FILES:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_FILES} files can be uploaded at once")
+
+    try:
+        items = json.loads(options)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid options")
+
+    if not isinstance(items, list) or len(items) != len(files):
+        raise HTTPException(status_code=400, detail="Options must be a list with one entry per file")
+
+    # every image in the batch counts against the upload limit
+    await run_in_threadpool(limit, request, "upload", user.email, len(files))
+
+    async def prepare(file: UploadFile, item) -> Union[PreparedUpload, str]:
+        try:
+            return await prepare_upload(file, ImageUploadRequest(**item))
+        except HTTPException as e:
+            return e.detail
+        except (TypeError, ValidationError):
+            return "Invalid options"
+
+    results = await asyncio.gather(*(prepare(file, item) for file, item in zip(files, items)))
+    uploads = [result for result in results if isinstance(result, PreparedUpload)]
+
+    if uploads:
+        await save_uploads(db, uploads)
+
+    return BatchUploadResponse(items=[
+        BatchUploadItem(filename=file.filename, image_id=result.row["id"], message=upload_message(result))
+        if isinstance(result, PreparedUpload) else BatchUploadItem(filename=file.filename, error=result)
+        for file, result in zip(files, results)
+    ])
 
 
 ##########
 
+# published inside the transaction and sent by the email workers, the request does not wait on smtp,
+# a broker that is down fails the request instead of committing an account nobody can verify
+def queue_email(db: Session, email: str, subject: str, body: str):
+    try:
+        send_email_task.delay(email, subject, body)
+    except Exception as e:
+        logger.error(f"Failed to queue email: {e}")
+        db.rollback()
+        raise HTTPException(status_code=503, detail="Email service unavailable, please try again later", headers={"Retry-After": "30"})
+
+
 @router.post("/register", tags=["auth"])
-async def register(
+def register(
     data: RegisterRequest,
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_db),
+    _: None = Depends(limit_by_ip("register"))
 ):
-    email, username, password = data.email.strip(), data.username.strip(), data.password.strip()
-    validate_email(email)
-    validate_username(username)
-    validate_password(password)
+    email, username, password = data.email, data.username, data.password
 
     try:
         # small project and db
         if db.query(User).filter_by(email=email).first() or db.query(User).filter_by(username=username).first():
             raise HTTPException(status_code=400, detail="User already registered")
         
-        sent_email, verification_code = send_register_email(email, username)
-        if not sent_email or not verification_code:
-            raise HTTPException(status_code=400, detail="Failed to send verification email")
+        subject, body, verification_code = register_email(email, username)
 
         user = User(
             email=email,
             username=username,
-            hashed_password=hash_password(password),
+            hashed_password=call_hash(hash_password, password),
             verification_code=verification_code,
             verification_expires_at=datetime.now(timezone.utc) + timedelta(minutes=15)
         )
 
         db.add(user)
+        db.flush()
+        queue_email(db, email, subject, body)
         db.commit()
 
         return MessageResponse(message="Registration successful. Please check your email to verify your account")
@@ -219,10 +594,8 @@ async def register(
 
 
 @router.post("/login", tags=["auth"])
-async def login(data: LoginRequest, db: Session = Depends(get_db)):
-    email, password = data.email.strip(), data.password.strip()
-    validate_email(email)
-    validate_password(password)
+def login(data: LoginRequest, db: Session = Depends(get_db), _: None = Depends(limit_by_ip("login"))):
+    email, password = data.email, data.password
 
     user = db.query(User).filter_by(email=email).first()
 
@@ -232,8 +605,18 @@ async def login(data: LoginRequest, db: Session = Depends(get_db)):
     if not user.verified:
         raise HTTPException(status_code=401, detail="User not verified. Please check your email for verification link")
 
-    if not user or not check_password(password, user.hashed_password):
+    valid, new_hash = call_hash(check_password_and_update, password, user.hashed_password)
+    if not valid:
         raise HTTPException(status_code=401, detail="Invalid email or password")
+
+    # hashes from an older scheme or cost are upgraded while the plain password is at hand
+    if new_hash:
+        try:
+            user.hashed_password = new_hash
+            db.commit()
+        except SQLAlchemyError as db_e:
+            logger.warning(f"Password rehash failed: {db_e}")
+            db.rollback()
     
     token = create_email_token(user.email)
 
@@ -266,7 +649,7 @@ def logout():
 
 
 @router.get("/verify", tags=["auth"])
-async def verify_account(data: VerifyRequest = Depends(), db: Session = Depends(get_db)):
+def verify_account(data: VerifyRequest = Depends(), db: Session = Depends(get_db)):
     verification_token = data.token.strip()
 
     if not verification_token:
@@ -314,34 +697,31 @@ async def verify_account(data: VerifyRequest = Depends(), db: Session = Depends(
     
 # forgot password endpoint getting email and sending reset link
 @router.post("/forgot-password", tags=["auth"])
-async def forgot_password(data: PasswordResetEmailRequest, db: Session = Depends(get_db)):
+def forgot_password(data: PasswordResetEmailRequest, db: Session = Depends(get_db), _: None = Depends(limit_by_ip("forgot_password"))):
     # always this message, to not leak if email is registered or not
     msg = "If this email is registered, a password reset link will be sent. Check the spam folder if you don't see it in your inbox"
 
-    email = data.email.strip()
-    validate_email(email)
+    email = data.email
 
     user = db.query(User).filter_by(email=email).first()
     if user:
-        sent_email, verification_code = send_password_reset_email(email, user.username)
-
-        if not sent_email or not verification_code:
-            logger.error("Failed to send password reset email to user " + email)
-        else:
-            try:
-                user.verification_code = verification_code
-                user.verification_expires_at = datetime.now(timezone.utc) + timedelta(minutes=15)
-                db.commit()
-            except SQLAlchemyError as db_e:
-                logger.error(f"Database error: {db_e}")
-                db.rollback()
-                raise HTTPException(status_code=500, detail="Database error")
+        subject, body, verification_code = password_reset_email(email, user.username)
+
+        try:
+            user.verification_code = verification_code
+            user.verification_expires_at = datetime.now(timezone.utc) + timedelta(minutes=15)
+            queue_email(db, email, subject, body)
+            db.commit()
+        except SQLAlchemyError as db_e:
+            logger.error(f"Database error: {db_e}")
+            db.rollback()
+            raise HTTPException(status_code=500, detail="Database error")
 
     return MessageResponse(message=msg)
 
 
 @router.post("/reset-password/verify", tags=["auth"])
-async def verify_reset_password_token(data: VerifyRequest, db: Session = Depends(get_db)):
+def verify_reset_password_token(data: VerifyRequest, db: Session = Depends(get_db)):
     verification_token = data.token.strip()
 
     if not verification_token:
@@ -371,9 +751,8 @@ async def verify_reset_password_token(data: VerifyRequest, db: Session = Depends
     return MessageResponse(message=f"Verification token is valid")
     
 @router.post("/reset-password", tags=["auth"])
-async def reset_password(data: PasswordResetRequest, db: Session = Depends(get_db)):
-    new_password = data.new_password.strip()
-    validate_password(new_password)
+def reset_password(data: PasswordResetRequest, db: Session = Depends(get_db)):
+    new_password = data.new_password
 
     #recheck token to be sure
     verification_token = data.token.strip()
@@ -402,7 +781,7 @@ async def reset_password(data: PasswordResetRequest, db: Session = Depends(get_d
         raise HTTPException(status_code=400, detail="Verification token expired")
 
     try:
-        user.hashed_password = hash_password(new_password)
+        user.hashed_password = call_hash(hash_password, new_password)
         user.verification_code = None
         user.verification_expires_at = None
 
@@ -412,4 +791,6 @@ async def reset_password(data: PasswordResetRequest, db: Session = Depends(get_d
         db.rollback()
         raise HTTPException(status_code=500, detail="Database error")
 
+    invalidate_sessions(email)
+
     return MessageResponse(message="Password reset successfully")
\ No newline at end of file
@@ -1,28 +1,69 @@
+from dataclasses import dataclass
 from datetime import datetime, timedelta, timezone
+import hashlib
+import logging
 import os
+import time
+from typing import Optional, Tuple
 import dotenv
 from fastapi import Depends, HTTPException, Request
 from passlib.context import CryptContext
 from jose import jwt, JWTError
+import redis
 from sqlalchemy.orm import Session
 
 from app.database import get_db
+from app.lru import LocalLRU
 from app.models import User
+from app.redis_client import redis_client
 
 dotenv.load_dotenv()
 
-pass_context = CryptContext(schemes= ["bcrypt"], deprecated= "auto")
+# the first scheme hashes new passwords, hashes in the others (or with other costs) still verify
+# and are upgraded on the next successful login, argon2 needs argon2-cffi installed
+PASSWORD_SCHEMES = [scheme.strip() for scheme in os.getenv("PASSWORD_SCHEMES", "bcrypt").split(",") if scheme.strip()]
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+ARGON2_TIME_COST = int(os.getenv("ARGON2_TIME_COST", "2"))
+ARGON2_MEMORY_COST = int(os.getenv("ARGON2_MEMORY_COST", "19456"))
+ARGON2_PARALLELISM = int(os.getenv("ARGON2_PARALLELISM", "1"))
+
+
+def create_pass_context(schemes: list) -> CryptContext:
+    options = {}
+    if "bcrypt" in schemes:
+        options["bcrypt__rounds"] = BCRYPT_ROUNDS
+    if "argon2" in schemes:
+        options.update(argon2__time_cost=ARGON2_TIME_COST, argon2__memory_cost=ARGON2_MEMORY_COST, argon2__parallelism=ARGON2_PARALLELISM)
+    return CryptContext(schemes=schemes, deprecated="auto", **options)
+
+
+pass_context = create_pass_context(PASSWORD_SCHEMES)
 
 SECRET_KEY = os.getenv("SECRET_KEY")
 ALGORITHM = os.getenv("ALGORITHM")
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES"))
 
+# after one correct password a protected image is served on this cookie alone until it expires
+IMAGE_GRANT_COOKIE = "image_grant"
+IMAGE_GRANT_SECONDS = int(os.getenv("IMAGE_GRANT_SECONDS", "900"))
+
+SESSION_CACHE_SIZE = int(os.getenv("SESSION_CACHE_SIZE", "10000"))
+SESSION_CACHE_TTL = int(os.getenv("SESSION_CACHE_TTL", "60"))
+# no principal cached before an invalidation outlives it, let alone its token
+SESSION_EPOCH_TTL = ACCESS_TOKEN_EXPIRE_MINUTES * 60
+
+logger = logging.getLogger(__name__)
+
 def hash_password(password: str) -> str:
     return pass_context.hash(password)
 
 def check_password(password: str, hashed_password: str) -> bool:
     return pass_context.verify(password, hashed_password)
 
+# returns whether the password matched and a new hash when the stored one uses an old scheme or cost
+def check_password_and_update(password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    return pass_context.verify_and_update(password, hashed_password)
+
 def create_email_token(email: str):
     expiry = datetime.now(timezone.utc) + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     data = {"email": email, "exp": expiry}
@@ -51,12 +92,74 @@ def decode_verification_token(token: str) -> dict:
         return None
 
 
-def get_current_user(request: Request, db: Session = Depends(get_db)):
+# scoped to one image id, so a grant for one image (or a login token) never opens another
+def create_image_grant(image_id: str) -> str:
+    expiry = datetime.now(timezone.utc) + timedelta(seconds=IMAGE_GRANT_SECONDS)
+    return jwt.encode({"image": image_id, "exp": expiry}, SECRET_KEY, algorithm=ALGORITHM)
+
+def has_image_grant(request: Request, image_id: str) -> bool:
+    token = request.cookies.get(IMAGE_GRANT_COOKIE)
+    if not token:
+        return False
+
+    try:
+        decoded = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except JWTError:
+        return False
+    return decoded.get("image") == image_id
+
+
+# what authenticated endpoints get instead of the full users row
+@dataclass(frozen=True)
+class Principal:
+    email: str
+    username: str
+    # jwt exp, a cached principal never outlives its token
+    expires_at: float
+    epoch: Optional[float]
+
+
+session_cache = LocalLRU(SESSION_CACHE_SIZE, SESSION_CACHE_TTL)
+
+
+def token_key(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+def session_epoch_key(email: str) -> str:
+    return f"session_epoch:{email}"
+
+
+# when the user's sessions were last invalidated, in redis so a password reset on one api process
+# drops the principals every other process cached, 0 when never, None when redis can't tell
+def session_epoch(email: str) -> Optional[float]:
+    try:
+        value = redis_client.get(session_epoch_key(email))
+    except redis.RedisError as e:
+        logger.warning(f"Session epoch read failed: {e}")
+        return None
+    return float(value) if value is not None else 0.0
+
+
+# a timestamp rather than a counter, a key that expired and is set again never repeats a value
+def invalidate_sessions(email: str):
+    try:
+        redis_client.set(session_epoch_key(email), time.time(), ex=SESSION_EPOCH_TTL)
+    except redis.RedisError as e:
+        logger.warning(f"Session invalidation failed for {email}: {e}")
+
+
+def get_current_user(request: Request, db: Session = Depends(get_db)) -> Principal:
     token = request.cookies.get("access_token")
 
     if not token:
         raise HTTPException(status_code=401, detail="Not authenticated")
 
+    key = token_key(token)
+    principal = session_cache.get(key)
+    if principal and principal.expires_at > time.time() and principal.epoch == session_epoch(principal.email):
+        return principal
+
     try:
         decoded = decode_email_token(token)
         if not decoded:
@@ -67,8 +170,16 @@ def get_current_user(request: Request, db: Session = Depends(get_db)):
     except JWTError:
         raise HTTPException(status_code=401, detail="Invalid auth token")
 
+    # read before the query so an invalidation racing with it is not lost
+    epoch = session_epoch(email)
+
     user = db.query(User).filter_by(email=email).first()
     if not user:
         raise HTTPException(status_code=401, detail="User not found")
 
-    return user
+    principal = Principal(email=user.email, username=user.username, expires_at=float(decoded["exp"]), epoch=epoch)
+    # without redis an invalidation could not reach the cached principal, so there is none
+    if epoch is not None:
+        session_cache.set(key, principal)
+
+    return principal
@@ -0,0 +1,77 @@
+from collections import Counter
+import hashlib
+import json
+from typing import Optional
+from sqlalchemy import bindparam, delete, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+from app.models import Blob
+
+# originals are keyed by their bytes (plus the format they are stored in and the profile they were
+# re-encoded with, none when stored as uploaded), processed outputs by the original they came from
+# plus everything that shaped them
+def original_key(content: bytes, ext: str, profile: Optional[str] = None) -> str:
+    digest = hashlib.sha256(content)
+    if profile:
+        digest.update(profile.encode())
+    return f"originals/{digest.hexdigest()}.{ext}"
+
+
+def processed_key(source_key: str, filters: list, width: Optional[int], height: Optional[int], ext: str, profile: str) -> str:
+    spec = json.dumps([source_key, filters or [], width or 0, height or 0, ext, profile], separators=(",", ":"))
+    return f"processed/{hashlib.sha256(spec.encode()).hexdigest()}.{ext}"
+
+
+# images stored before dedup keep their files under their own id
+def image_original_key(image_id: str, ext: str, key: Optional[str]) -> str:
+    return key or f"originals/{image_id}.{ext}"
+
+
+def image_processed_key(image_id: str, ext: str, key: Optional[str]) -> str:
+    return key or f"processed/{image_id}.{ext}"
+
+
+def add_ref(db: Session, key: str, count: int = 1):
+    insert = postgresql.insert if db.bind.dialect.name == "postgresql" else sqlite.insert
+    db.execute(
+        insert(Blob).values(key=key, refcount=count).on_conflict_do_update(
+            index_elements=[Blob.key], set_={"refcount": Blob.refcount + count}
+        )
+    )
+
+
+# only succeeds for a blob that is stored and still referenced, blob rows are created
+# after their file is written and deleted while the file is removed
+def try_add_ref(db: Session, key: str, count: int = 1) -> bool:
+    result = db.execute(update(Blob).where(Blob.key == key, Blob.refcount > 0).values(refcount=Blob.refcount + count))
+    return result.rowcount == 1
+
+
+# the size in bytes of every format a processed blob is stored in, for content negotiation,
+# and its pixel width, derivatives are only stored for narrower widths, outputs maps key -> (sizes, width)
+def set_variants(db: Session, outputs: dict):
+    if not outputs:
+        return
+
+    blobs = Blob.__table__
+    db.execute(
+        update(blobs).where(blobs.c.key == bindparam("b_key")).values(variants=bindparam("b_variants"), width=bindparam("b_width")),
+        [{"b_key": key, "b_variants": variants, "b_width": width} for key, (variants, width) in outputs.items()],
+    )
+
+
+# returns the keys nobody references any more, their rows are gone and the caller deletes
+# the objects before committing, so a concurrent add_ref waits on the row lock until then
+def release_refs(db: Session, keys: list) -> list:
+    counts = Counter(key for key in keys if key)
+    if not counts:
+        return []
+
+    blobs = Blob.__table__
+    db.execute(
+        update(blobs).where(blobs.c.key == bindparam("b_key")).values(refcount=blobs.c.refcount - bindparam("b_count")),
+        [{"b_key": key, "b_count": count} for key, count in counts.items()],
+    )
+
+    return list(db.execute(delete(Blob).where(Blob.key.in_(list(counts)), Blob.refcount <= 0).returning(Blob.key)).scalars())
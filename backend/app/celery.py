@@ -1,13 +1,30 @@
-from datetime import datetime, timezone
+from collections import Counter
+from contextlib import ExitStack
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta, timezone
 import os
-from PIL import Image, ImageFilter
-from celery import Celery
+import smtplib
+import time
+from typing import Optional, Tuple
+from celery import Celery, group
 from celery.schedules import crontab
+from celery.signals import before_task_publish, task_postrun, task_prerun, worker_init, worker_process_init
 import dotenv
-import numpy as np
+from sqlalchemy import and_, delete, func, or_, select, update
+from sqlalchemy.exc import SQLAlchemyError
 
-from app.database import SessionLocal
-from app.models import Image as ImageModel, User
+from app.blobs import add_ref, image_original_key, image_processed_key, release_refs, set_variants
+from app.database import SessionLocal, engine
+from app.derivatives import DERIVATIVE_WIDTHS, companion_keys, derivative_key, derivative_parent
+from app.email import send_email
+from app.formats import encode_options, save_format_for, variant_key, variant_parent, variants_for
+from app.image_cache import invalidate_image, invalidate_images
+from app.image_status import publish_status, publish_statuses
+from app.metrics import CLEANUP_BATCH_SECONDS, CLEANUP_ROWS, start_exporter
+from app.models import Blob, Image as ImageModel, User
+from app.pipeline import Output, UnprocessableImage, compile_plan, execute_plan, output_width
+from app.storage import storage
+from app.task_metrics import record_task
 
 dotenv.load_dotenv()
 
@@ -17,65 +34,324 @@ celery_app = Celery(
     backend=os.getenv("CELERY_RESULT_BACKEND", "redis://localhost:6379/0")
 )
 
+# prefork children must not share the parent's pooled connections
+@worker_process_init.connect
+def reset_db_pool(**kwargs):
+    engine.dispose(close=False)
+
+
+# served by the main worker process, for every child that wrote to PROMETHEUS_MULTIPROC_DIR,
+# a worker that can't bind the port still runs, it just isn't scraped
+@worker_init.connect
+def start_metrics_exporter(**kwargs):
+    try:
+        start_exporter()
+    except OSError as e:
+        print(f"Metrics exporter not started: {e}")
+
+
+# single images are routed by estimated cost, each queue has its own workers
+# so a burst of large blurs never sits in front of a thumbnail
+FAST_QUEUE_MAX_MS = float(os.getenv("FAST_QUEUE_MAX_MS", "100"))
+HEAVY_QUEUE_MIN_MS = float(os.getenv("HEAVY_QUEUE_MIN_MS", "500"))
+PROCESS_QUEUES = ["fast", "standard", "heavy", "batch"]
+
+
+def queue_for_cost(cost_ms: float) -> str:
+    if cost_ms <= FAST_QUEUE_MAX_MS:
+        return "fast"
+    if cost_ms >= HEAVY_QUEUE_MIN_MS:
+        return "heavy"
+    return "standard"
+
+
+@before_task_publish.connect
+def stamp_enqueued_at(headers=None, **kwargs):
+    headers["enqueued_at"] = time.time()
+
+
+@task_prerun.connect
+def mark_task_start(task=None, **kwargs):
+    task.request.started_at = time.time()
+
+
+# eager calls never went through a queue and carry no stamp
+@task_postrun.connect
+def record_task_latency(task=None, **kwargs):
+    enqueued_at = getattr(task.request, "enqueued_at", None)
+    started_at = getattr(task.request, "started_at", None)
+    if enqueued_at is None or started_at is None:
+        return
+
+    queue = (task.request.delivery_info or {}).get("routing_key") or "celery"
+    record_task(queue, max(0.0, started_at - enqueued_at), time.time() - started_at)
+
+
+# derivatives and variants are published before the processed image, once that exists they exist too,
+# returns the bytes per format of the full size outputs and their pixel width
+def process_to_storage(plan, source_key: str, dest_key: str) -> Tuple[dict, int]:
+    ext = dest_key.rsplit(".", 1)[1]
+    options = encode_options(plan.save_format, plan.profile)
+    variants = variants_for(plan.save_format, plan.profile)
+
+    with ExitStack() as stack:
+        source = stack.enter_context(storage.read_path(source_key))
+
+        # a derivative at least as wide as the image would be the same pixels encoded again
+        image_width = output_width(plan, source)
+        widths = [width for width in DERIVATIVE_WIDTHS if width < image_width]
+
+        outputs = [(dest_key, None, ext, plan.save_format, options)]
+        outputs += [(derivative_key(dest_key, width), width, ext, plan.save_format, options) for width in widths]
+        outputs += [(variant_key(key, variant_ext), width, variant_ext, *variants[variant_ext]) for key, width, *_ in list(outputs) for variant_ext in variants]
+
+        paths = [stack.enter_context(storage.write_path(key)) for key, *_ in outputs]
+        sizes = execute_plan(plan, source, [
+            Output(path=path, format=save_format, width=width, options=options)
+            for path, (_, width, _, save_format, options) in zip(paths, outputs)
+        ])
+
+    return {output_ext: size for (_, width, output_ext, _, _), size in zip(outputs, sizes) if width is None}, image_width
+
+
+# the outbox's sent marker, written once the broker accepted the message, a row without it is
+# sent again by redispatch_stalled_images, which costs at most a duplicate message
+def mark_dispatched(image_ids: list, dispatched_at: datetime):
+    db = SessionLocal()
+    try:
+        db.execute(update(ImageModel).where(ImageModel.id.in_(image_ids)).values(dispatched_at=dispatched_at))
+        db.commit()
+    except SQLAlchemyError as e:
+        db.rollback()
+        print(f"Failed to mark images {image_ids} as dispatched: {e}")
+    finally:
+        db.close()
+
+
+# committed before the work starts, a started image that never finishes is what a lost worker
+# looks like to redispatch_stalled_images, rows that are no longer processing are not claimed,
+# so a duplicate message for a finished or failed image does nothing
+def claim(db, image_ids: list) -> list:
+    claimed = db.execute(
+        update(ImageModel)
+        .where(ImageModel.id.in_(image_ids), ImageModel.status == "PROCESSING")
+        .values(started_at=datetime.now(timezone.utc), attempts=func.coalesce(ImageModel.attempts, 0) + 1)
+        .returning(ImageModel.id)
+    ).scalars().all()
+    db.commit()
+    return claimed
+
+
+# terminal, only for images that can never be processed, a row another task completed in between is left alone
+def mark_failed(db, image_ids: list):
+    try:
+        db.execute(update(ImageModel).where(ImageModel.id.in_(image_ids), ImageModel.status == "PROCESSING").values(status="FAILED"))
+        db.commit()
+    except SQLAlchemyError as e:
+        db.rollback()
+        print(f"Failed to mark images {image_ids} as failed: {e}")
+
+    invalidate_images(image_ids)
+    publish_statuses(image_ids, "FAILED")
+
+
 @celery_app.task
 def process_image_task(image_id: str, filters: list, width: int = 0, height: int = 0):
+    db = SessionLocal()
     try:
-        db = SessionLocal()
-        image_model = db.query(ImageModel).filter_by(id=image_id).first()
-        if not image_model:
-            raise ValueError(f"Image with ID {image_id} not found in db.")
+        if not claim(db, [image_id]):
+            return {"image_id": image_id, "status": "SKIPPED", "message": "Image already finished or deleted."}
+
+        query = db.query(ImageModel).filter_by(id=image_id)
+        if db.bind.dialect.name == "postgresql":
+            # a redispatched duplicate waits here and then sees the image completed
+            query = query.with_for_update()
+
+        image_model = query.first()
+        if not image_model or image_model.status != "PROCESSING":
+            return {"image_id": image_id, "status": "SKIPPED", "message": "Image already finished or deleted."}
 
         ext = image_model.format.lower().strip()
-        save_format = "PNG" if ext == "png" else "JPEG"
-
-        image = Image.open(f"storage/originals/{image_id}.{ext}")
-        if width and height:
-            image = image.resize((width, height))
-
-        alpha = None
-        if image.mode == "RGBA" and save_format == "PNG":
-            alpha = image.split()[-1]
-            image = image.convert("RGB")
-
-        for filter_name in filters:
-            if filter_name == "grayscale":
-                image = image.convert("L")
-            elif filter_name == "color_inversion":
-                image_array = np.array(image)
-                image_array = 255 - image_array
-                image = Image.fromarray(image_array)
-            elif filter_name == "sepia":
-                image_array = np.array(image).astype(float)
-                sepia_matrix = np.array([[0.393, 0.769, 0.189],
-                                         [0.349, 0.686, 0.168],
-                                         [0.272, 0.534, 0.131]])
-                
-                image_array = np.clip(image_array @ sepia_matrix.T, 0, 255).astype(np.uint8)
-                image = Image.fromarray(image_array)
-            elif filter_name == "blur":
-                image = image.filter(ImageFilter.GaussianBlur(radius=6))
-
-        if alpha:
-            image = image.convert("RGBA")
-            image.putalpha(alpha)
-
-        os.makedirs("storage/processed", exist_ok=True)
-        path = f"storage/processed/{image_id}.{ext}"
-
-        image.save(path, format=save_format)
+
+        plan = compile_plan(filters, width, height, save_format_for(ext), image_model.encode_profile)
+        source = image_original_key(image_id, ext, image_model.original_key)
+        dest = image_processed_key(image_id, ext, image_model.processed_key)
+
+        # an identical job may have produced this blob already
+        output = None
+        if not storage.exists(dest):
+            output = process_to_storage(plan, source, dest)
+
+        if image_model.processed_key:
+            add_ref(db, image_model.processed_key)
+            db.flush()
+
+            # cleanup may have released the last reference in between, the row lock is held now
+            if not storage.exists(dest):
+                output = process_to_storage(plan, source, dest)
+
+            if output:
+                set_variants(db, {image_model.processed_key: output})
+
         image_model.status = "COMPLETED"
         if width and height and width > 0 and height > 0:
             image_model.width = width
             image_model.height = height
         db.commit()
-        db.close()
+        invalidate_image(image_id)
+        publish_status(image_id, "COMPLETED")
 
         return {"image_id": image_id, "status": "COMPLETED", "message": "Image processed successfully."}
 
+    except (UnprocessableImage, ValueError) as e:
+        # the image or its options, every attempt would fail the same way
+        db.rollback()
+        mark_failed(db, [image_id])
+        return {"image_id": image_id, "status": "FAILED", "message": str(e)}
+
     except Exception as e:
+        # storage, database or redis trouble, the row stays processing and is sent again once its start went stale
         db.rollback()
+        print(f"Processing image {image_id} failed, left for redispatch: {e}")
+        return {"image_id": image_id, "status": "PROCESSING", "message": str(e)}
+
+    finally:
         db.close()
-        return {"image_id": image_id, "status": "FAILED", "message": str(e)}
+
+
+# one message per upload batch, consumed by a solo worker that owns a process pool,
+# prefork children are daemonic and cannot start one
+PROCESS_BATCH_SIZE = int(os.getenv("PROCESS_BATCH_SIZE", "32"))
+PROCESS_POOL_SIZE = int(os.getenv("PROCESS_POOL_SIZE", str(os.cpu_count() or 1)))
+
+celery_app.conf.task_routes = {"app.celery.process_image_batch_task": {"queue": "batch"}}
+
+process_pool = None
+
+
+def get_process_pool() -> ProcessPoolExecutor:
+    global process_pool
+    if process_pool is None:
+        process_pool = ProcessPoolExecutor(max_workers=PROCESS_POOL_SIZE)
+    return process_pool
+
+
+# runs in the pool, only touches storage, returns the error and whether it is permanent,
+# or the bytes per format and the width
+def process_job(filters: list, width: int, height: int, save_format: str, profile: Optional[str], source_key: str, dest_key: str) -> Tuple[Optional[Tuple[str, bool]], Optional[Tuple[dict, int]]]:
+    try:
+        return None, process_to_storage(compile_plan(filters, width, height, save_format, profile), source_key, dest_key)
+    except (UnprocessableImage, ValueError) as e:
+        return (f"{dest_key}: {e}", True), None
+    except Exception as e:
+        return (f"{dest_key}: {e}", False), None
+
+
+# images sharing an output are processed once, returns (error, permanent) for every output
+# that failed and the bytes per format and the width for every one that succeeded
+def run_jobs(jobs: dict) -> Tuple[dict, dict]:
+    futures = {dest: get_process_pool().submit(process_job, *job) for dest, job in jobs.items()}
+    results = {dest: future.result() for dest, future in futures.items()}
+    errors = {dest: error for dest, (error, _) in results.items() if error}
+    outputs = {dest: output for dest, (_, output) in results.items() if output}
+    return errors, outputs
+
+
+@celery_app.task
+def process_image_batch_task(image_ids: list):
+    db = SessionLocal()
+    try:
+        # one query for the whole batch, rows deleted or finished in the meantime are skipped
+        claimed = claim(db, image_ids)
+        query = (
+            select(ImageModel.id, ImageModel.format, ImageModel.filters, ImageModel.width, ImageModel.height, ImageModel.original_key, ImageModel.processed_key, ImageModel.encode_profile)
+            .where(ImageModel.id.in_(claimed), ImageModel.status == "PROCESSING")
+        )
+        if db.bind.dialect.name == "postgresql":
+            # rows a redispatched duplicate is already working on are left to it
+            query = query.with_for_update(skip_locked=True)
+
+        rows = db.execute(query).all()
+
+        jobs = {}
+        dests = {}
+        for row in rows:
+            ext = row.format.lower().strip()
+            dest = image_processed_key(row.id, ext, row.processed_key)
+            dests[row.id] = dest
+            jobs[dest] = (row.filters or [], row.width or 0, row.height or 0, save_format_for(ext), row.encode_profile, image_original_key(row.id, ext, row.original_key), dest)
+
+        # an identical job may have produced these blobs already
+        errors, outputs = run_jobs({dest: job for dest, job in jobs.items() if not storage.exists(dest)})
+        done = [row for row in rows if dests[row.id] not in errors]
+
+        refs = Counter(row.processed_key for row in done if row.processed_key)
+        for key in sorted(refs):
+            add_ref(db, key, refs[key])
+        db.flush()
+
+        # cleanup may have released the last reference in between, the row locks are held now
+        restore_errors, restored = run_jobs({key: jobs[key] for key in refs if not storage.exists(key)})
+        errors.update(restore_errors)
+        outputs.update(restored)
+        if any(key in errors for key in refs):
+            raise RuntimeError(f"Failed to restore processed images: {[errors[key][0] for key in refs if key in errors]}")
+
+        set_variants(db, {key: outputs[key] for key in refs if key in outputs})
+
+        # only the images that raised a permanent error fail, the others that raised stay
+        # processing and are sent again once their start went stale
+        completed = [row.id for row in done]
+        failed = [row.id for row in rows if dests[row.id] in errors and errors[dests[row.id]][1]]
+        if completed:
+            db.execute(update(ImageModel).where(ImageModel.id.in_(completed)).values(status="COMPLETED"))
+        if failed:
+            db.execute(update(ImageModel).where(ImageModel.id.in_(failed)).values(status="FAILED"))
+        db.commit()
+        invalidate_images(completed + failed)
+
+        publish_statuses(completed, "COMPLETED")
+        publish_statuses(failed, "FAILED")
+        return {"completed": completed, "failed": failed, "errors": [error for error, _ in errors.values()]}
+
+    except Exception as e:
+        # nothing in here is specific to one image, the whole batch is left for redispatch
+        db.rollback()
+        print(f"Processing batch {image_ids} failed, left for redispatch: {e}")
+        return {"completed": [], "failed": [], "errors": [str(e)]}
+    finally:
+        db.close()
+
+
+def dispatch_batches(image_ids: list):
+    group(
+        process_image_batch_task.s(image_ids[start:start + PROCESS_BATCH_SIZE]) for start in range(0, len(image_ids), PROCESS_BATCH_SIZE)
+    ).apply_async()
+
+
+# requests only publish the message, the email workers send a burst back to back over the
+# session each of them keeps open, transient failures are retried with exponential backoff
+EMAIL_MAX_RETRIES = int(os.getenv("EMAIL_MAX_RETRIES", "6"))
+EMAIL_RETRY_BACKOFF_MAX = int(os.getenv("EMAIL_RETRY_BACKOFF_MAX", "600"))
+
+celery_app.conf.task_routes["app.celery.send_email_task"] = {"queue": "email"}
+
+
+@celery_app.task(
+    autoretry_for=(smtplib.SMTPException, OSError),
+    retry_backoff=True,
+    retry_backoff_max=EMAIL_RETRY_BACKOFF_MAX,
+    retry_jitter=True,
+    max_retries=EMAIL_MAX_RETRIES,
+)
+def send_email_task(to_email: str, subject: str, body: str):
+    try:
+        send_email(to_email, subject, body)
+    except smtplib.SMTPRecipientsRefused as e:
+        # a rejected address fails the same way on every retry
+        print(f"Email to {to_email} refused: {e.recipients}")
+        return False
+    return True
 
 
 celery_cleanup = Celery(
@@ -83,40 +359,212 @@ celery_cleanup = Celery(
     broker=os.getenv("CELERY_BROKER_URL", "redis://localhost:6379/0")
 )
 
+# own queue, so the image workers never receive cleanup messages and the other way around
+celery_cleanup.conf.task_default_queue = "cleanup"
+
 celery_cleanup.conf.beat_schedule = {
     'cleanup_expired_data': {
         'task': 'app.celery.cleanup_expired_data',
         'schedule': crontab(minute="*/15"),
     },
+    'reconcile_orphan_files': {
+        'task': 'app.celery.reconcile_orphan_files',
+        'schedule': crontab(minute=30, hour=3),
+    },
+    'redispatch_stalled_images': {
+        'task': 'app.celery.redispatch_stalled_images',
+        'schedule': crontab(minute="*"),
+    },
 }
 
+CLEANUP_BATCH_SIZE = int(os.getenv("CLEANUP_BATCH_SIZE", "1000"))
+# a run stops starting new batches after this, the next beat tick picks up the rest
+CLEANUP_MAX_SECONDS = int(os.getenv("CLEANUP_MAX_SECONDS", "600"))
+# files younger than this may belong to an upload whose row is not committed yet
+ORPHAN_GRACE_SECONDS = int(os.getenv("ORPHAN_GRACE_SECONDS", "3600"))
+# a message the broker never confirmed this long after the upload, or a worker that started on an
+# image this long ago without finishing it, is assumed lost, a message still waiting in a queue never is
+STALLED_PROCESSING_SECONDS = int(os.getenv("STALLED_PROCESSING_SECONDS", "300"))
+# images are given up on once workers started on them this many times or after this age, an image
+# that kills its worker before the task can handle the error does not get sent again forever
+MAX_PROCESSING_ATTEMPTS = int(os.getenv("MAX_PROCESSING_ATTEMPTS", "3"))
+STALLED_PROCESSING_MAX_AGE = int(os.getenv("STALLED_PROCESSING_MAX_AGE", "86400"))
+
+# every queue a worker in docker-compose.yml consumes, reported on the api's /metrics
+QUEUES = PROCESS_QUEUES + ["celery", "email", "cleanup"]
+
+STORAGE_PREFIXES = ["originals", "processed", "derivatives", "variants/processed", "variants/derivatives"]
+
+
+def legacy_keys(image_id: str, format: str) -> list:
+    ext = format.lower().strip()
+    return [image_original_key(image_id, ext, None), image_processed_key(image_id, ext, None)]
+
+
 @celery_cleanup.task
 def cleanup_expired_data():
+    db = SessionLocal()
+    start = time.monotonic()
+    deleted_images = 0
+    removed_files = 0
+
     try:
-        db = SessionLocal()
+        # expired images, one bounded transaction per batch
+        while time.monotonic() - start < CLEANUP_MAX_SECONDS:
+            batch_start = time.monotonic()
+            batch = select(ImageModel.id).where(ImageModel.expires_at < datetime.now(timezone.utc)).order_by(ImageModel.expires_at).limit(CLEANUP_BATCH_SIZE)
+            if db.bind.dialect.name == "postgresql":
+                # two overlapping runs split the backlog instead of waiting on each other
+                batch = batch.with_for_update(skip_locked=True)
+
+            rows = db.execute(
+                delete(ImageModel).where(ImageModel.id.in_(batch.scalar_subquery())).returning(
+                    ImageModel.id, ImageModel.format, ImageModel.status, ImageModel.original_key, ImageModel.processed_key
+                )
+            ).all()
 
-        # expired images
-        expired_images = db.query(ImageModel).filter(ImageModel.expires_at < datetime.now(timezone.utc)).all()
+            if not rows:
+                db.commit()
+                break
 
-        for img in expired_images:
-            db.delete(img)
+            # a processed reference is only taken once processing completed
+            released = [row.original_key for row in rows] + [row.processed_key for row in rows if row.status == "COMPLETED"]
+            keys = release_refs(db, released)
+            keys += [key for row in rows if not row.original_key for key in legacy_keys(row.id, row.format)]
+            keys += [companion for key in keys if key.startswith("processed/") for companion in companion_keys(key)]
 
-            if os.path.exists(f"storage/originals/{img.id}.png"):
-                os.remove(f"storage/originals/{img.id}.png")
+            # deleted before the commit, the released blob rows stay locked until the objects are gone
+            batch_files = storage.delete_many(keys)
+            db.commit()
 
-            if os.path.exists(f"storage/processed/{img.id}.png"):
-                os.remove(f"storage/processed/{img.id}.png")
+            removed_files += batch_files
+            deleted_images += len(rows)
+            invalidate_images([row.id for row in rows])
 
-        # expired users
-        expired_unverified_users = db.query(User).filter(User.verified == False, User.verification_expires_at < datetime.now(timezone.utc)).all()
-        for user in expired_unverified_users:
-            db.delete(user)
+            CLEANUP_BATCH_SECONDS.labels("cleanup_expired_data").observe(time.monotonic() - batch_start)
+            CLEANUP_ROWS.labels("images").inc(len(rows))
+            CLEANUP_ROWS.labels("files").inc(batch_files)
 
+            if len(rows) < CLEANUP_BATCH_SIZE:
+                break
+
+        # expired users, set based
+        deleted_users = db.execute(
+            delete(User).where(User.verified == False, User.verification_expires_at < datetime.now(timezone.utc))
+        ).rowcount
         db.commit()
-        print(f"Cleaned up {len(expired_images)} expired images and {len(expired_unverified_users)} expired unverified users.")
+        CLEANUP_ROWS.labels("users").inc(deleted_users)
+
+        elapsed = time.monotonic() - start
+        print(f"Cleaned up {deleted_images} expired images ({removed_files} files) and {deleted_users} expired unverified users "
+              f"in {elapsed:.2f}s ({deleted_images / elapsed if elapsed else 0:.0f} images/s).")
+
+        return {"images": deleted_images, "files": removed_files, "users": deleted_users, "seconds": elapsed}
     except Exception as e:
         db.rollback()
         print(f"Error during cleanup: {e}")
         raise e
     finally:
         db.close()
+
+
+# files left behind with no images row, failed uploads or files from before cleanup covered every format
+@celery_cleanup.task
+def reconcile_orphan_files():
+    db = SessionLocal()
+    start = time.monotonic()
+    scanned = 0
+    removed = 0
+    cutoff = time.time() - ORPHAN_GRACE_SECONDS
+
+    def stem(key: str) -> str:
+        return key.rsplit("/", 1)[-1].split(".", 1)[0]
+
+    # variants belong to the file they were encoded from, derivatives to the processed image
+    def owner(key: str) -> str:
+        if key.startswith("variants/"):
+            key = variant_parent(key)
+        return derivative_parent(key) if key.startswith("derivatives/") else key
+
+    # an object is known if it is a referenced blob or a pre-dedup file named after its image id
+    def sweep(chunk):
+        batch_start = time.monotonic()
+        owners = {owner(key) for key in chunk}
+        known = set(db.execute(select(Blob.key).where(Blob.key.in_(owners))).scalars())
+        known |= set(db.execute(select(ImageModel.id).where(ImageModel.id.in_({stem(key) for key in owners}))).scalars())
+
+        orphans = storage.delete_many([key for key in chunk if owner(key) not in known and stem(owner(key)) not in known])
+        CLEANUP_BATCH_SECONDS.labels("reconcile_orphan_files").observe(time.monotonic() - batch_start)
+        CLEANUP_ROWS.labels("orphans").inc(orphans)
+        return orphans
+
+    try:
+        chunk = []
+        for prefix in STORAGE_PREFIXES:
+            for key, mtime in storage.list(prefix):
+                scanned += 1
+                if mtime > cutoff:
+                    continue
+
+                chunk.append(key)
+                if len(chunk) >= CLEANUP_BATCH_SIZE:
+                    removed += sweep(chunk)
+                    chunk = []
+
+        if chunk:
+            removed += sweep(chunk)
+
+        elapsed = time.monotonic() - start
+        print(f"Reconciled storage: scanned {scanned} files, removed {removed} orphans in {elapsed:.2f}s.")
+
+        return {"scanned": scanned, "removed": removed, "seconds": elapsed}
+    finally:
+        db.close()
+
+
+# the images table doubles as the outbox, a PROCESSING row is work that has not completed yet,
+# it is sent again when the broker never confirmed its message or when a worker started on it,
+# went quiet and nothing was sent since, a message that is only waiting in a queue is left alone
+@celery_cleanup.task
+def redispatch_stalled_images():
+    db = SessionLocal()
+    now = datetime.now(timezone.utc)
+    stale = now - timedelta(seconds=STALLED_PROCESSING_SECONDS)
+    # rows from before starts were tracked count as never started
+    attempts = func.coalesce(ImageModel.attempts, 0)
+
+    try:
+        query = (
+            select(ImageModel.id, attempts < MAX_PROCESSING_ATTEMPTS, ImageModel.created_at > now - timedelta(seconds=STALLED_PROCESSING_MAX_AGE))
+            .where(
+                ImageModel.status == "PROCESSING",
+                or_(
+                    and_(ImageModel.dispatched_at.is_(None), ImageModel.created_at < stale),
+                    and_(ImageModel.started_at < stale, ImageModel.dispatched_at <= ImageModel.started_at),
+                ),
+            )
+            .order_by(ImageModel.created_at)
+            .limit(CLEANUP_BATCH_SIZE)
+        )
+        if db.bind.dialect.name == "postgresql":
+            # rows a worker holds are being processed right now
+            query = query.with_for_update(skip_locked=True)
+
+        rows = db.execute(query).all()
+        image_ids = [image_id for image_id, retry, recent in rows if retry and recent]
+        given_up = [image_id for image_id, retry, recent in rows if not (retry and recent)]
+        db.commit()
+
+        if given_up:
+            mark_failed(db, given_up)
+            print(f"Gave up on {len(given_up)} stalled images.")
+    finally:
+        db.close()
+
+    if image_ids:
+        dispatched_at = datetime.now(timezone.utc)
+        dispatch_batches(image_ids)
+        mark_dispatched(image_ids, dispatched_at)
+        print(f"Redispatched {len(image_ids)} stalled images.")
+
+    return {"redispatched": len(image_ids), "failed": len(given_up)}
@@ -1,19 +1,142 @@
-from sqlalchemy import create_engine
+import logging
+import threading
+import time
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from sqlalchemy import create_engine, event, inspect, text
 from sqlalchemy.orm import sessionmaker, declarative_base
+from sqlalchemy.pool import QueuePool
 import dotenv
 import os
 
+from app.metrics import DB_CHECKOUT_SECONDS, DB_QUERY_SECONDS
+
 dotenv.load_dotenv()
 
 DATABASE_URL = os.getenv("DATABASE_URL")
 
-engine = create_engine(DATABASE_URL, echo=True)
+# api serves many concurrent requests from one process, every celery worker process
+# runs one task at a time and only needs a connection or two
+DB_PROFILE = os.getenv("DB_PROFILE", "api")
+
+PROFILE_DEFAULTS = {
+    "api": {"POOL_SIZE": 10, "MAX_OVERFLOW": 10},
+    "worker": {"POOL_SIZE": 2, "MAX_OVERFLOW": 2},
+}
+
+DB_SLOW_QUERY_MS = float(os.getenv("DB_SLOW_QUERY_MS", "200"))
+
+logger = logging.getLogger(__name__)
+
+
+# DB_<PROFILE>_<NAME> overrides DB_<NAME>, which overrides the profile default
+def pool_setting(name: str, default):
+    value = os.getenv(f"DB_{DB_PROFILE.upper()}_{name}", os.getenv(f"DB_{name}"))
+    if value is None:
+        return PROFILE_DEFAULTS.get(DB_PROFILE, {}).get(name, default)
+
+    if isinstance(default, bool):
+        return value.lower() in ("1", "true", "yes")
+    return type(default)(value)
+
+
+# only slow statements take the lock, every statement is timed by DB_QUERY_SECONDS
+slow_queries = 0
+slow_queries_lock = threading.Lock()
+
+
+# times how long callers queue for a connection, the pool events only fire once one is handed out
+class TimedQueuePool(QueuePool):
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            DB_CHECKOUT_SECONDS.observe(time.perf_counter() - start)
+
+
+engine = create_engine(
+    DATABASE_URL,
+    echo=pool_setting("ECHO", False),
+    poolclass=TimedQueuePool,
+    pool_size=pool_setting("POOL_SIZE", 5),
+    max_overflow=pool_setting("MAX_OVERFLOW", 10),
+    pool_timeout=pool_setting("POOL_TIMEOUT", 30),
+    # rds drops idle connections, recycle well before that and ping on checkout
+    pool_recycle=pool_setting("POOL_RECYCLE", 1800),
+    pool_pre_ping=pool_setting("POOL_PRE_PING", True),
+)
+
+
+@event.listens_for(engine, "before_cursor_execute")
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start_time", []).append(time.perf_counter())
+
+
+@event.listens_for(engine, "after_cursor_execute")
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    global slow_queries
+    elapsed = time.perf_counter() - conn.info["query_start_time"].pop()
+    DB_QUERY_SECONDS.observe(elapsed)
+
+    if elapsed * 1000 >= DB_SLOW_QUERY_MS:
+        with slow_queries_lock:
+            slow_queries += 1
+        logger.warning(f"Slow query ({elapsed * 1000:.1f} ms): {' '.join(statement.split())[:500]}")
+
+
+# pool state of this process, read when /metrics is scraped
+class DBPoolCollector:
+    # nothing to declare up front, registering would otherwise collect once to find the names
+    def describe(self):
+        return []
+
+    def collect(self):
+        pool = engine.pool
+        for name, value in (("pool_size", pool.size()), ("checked_out", pool.checkedout()), ("checked_in", pool.checkedin()), ("overflow", pool.overflow())):
+            yield GaugeMetricFamily(f"rapidpic_db_pool_{name}", f"Connection pool {name.replace('_', ' ')}", value=value)
+        yield CounterMetricFamily("rapidpic_db_slow_queries", f"Statements slower than {DB_SLOW_QUERY_MS:g} ms", value=slow_queries)
+
+
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
+
+# runs callback once the session's current transaction has committed, dropped on rollback
+def after_commit(db, callback):
+    db.info.setdefault("after_commit", []).append(callback)
+
+
+@event.listens_for(SessionLocal, "after_commit")
+def run_after_commit(session):
+    for callback in session.info.pop("after_commit", []):
+        # the data is committed either way, whatever the callback missed has to be recoverable
+        try:
+            callback()
+        except Exception as e:
+            logger.error(f"After commit callback failed: {e}")
+
+
+@event.listens_for(SessionLocal, "after_soft_rollback")
+def drop_after_commit(session, previous_transaction):
+    session.info.pop("after_commit", None)
+
 def init_db():
     Base.metadata.create_all(bind=engine)
 
+    # create_all skips tables that already exist, so nullable columns added later are created here
+    existing = inspect(engine)
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            columns = {column["name"] for column in existing.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in columns and column.nullable:
+                    conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(engine.dialect)}"))
+
+    # create_all skips tables that already exist, so indexes added later are created here
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
+
 def get_db():
     db = SessionLocal()
     try:
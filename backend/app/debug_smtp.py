@@ -0,0 +1,89 @@
+# a plain smtp server that keeps and logs every message instead of delivering it, for local runs and tests
+# run from backend/: python -m app.debug_smtp [port], then SMTP_HOST=localhost SMTP_PORT=1025 SMTP_STARTTLS=false
+from email import message_from_bytes, policy
+from email.message import EmailMessage
+import logging
+import socketserver
+import sys
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class DebugSMTPHandler(socketserver.StreamRequestHandler):
+    def reply(self, line: str):
+        self.wfile.write(f"{line}\r\n".encode())
+
+    def handle(self):
+        self.reply("220 debug smtp ready")
+        recipients = []
+
+        for raw in self.rfile:
+            command, _, argument = raw.decode(errors="replace").rstrip("\r\n").partition(" ")
+            command = command.upper()
+
+            if command == "EHLO":
+                self.reply("250-debug smtp")
+                self.reply("250 AUTH PLAIN LOGIN")
+            elif command == "HELO":
+                self.reply("250 debug smtp")
+            elif command == "AUTH":
+                self.reply("235 accepted")
+            elif command == "MAIL":
+                recipients = []
+                self.reply("250 ok")
+            elif command == "RCPT":
+                recipients.append(argument.partition(":")[2].strip("<> "))
+                self.reply("250 ok")
+            elif command == "DATA":
+                self.reply("354 end with .")
+                lines = []
+                for line in self.rfile:
+                    if line.rstrip(b"\r\n") == b".":
+                        break
+                    # dot stuffing, a leading dot was doubled by the client
+                    lines.append(line[1:] if line.startswith(b"..") else line)
+
+                self.server.deliver(recipients, message_from_bytes(b"".join(lines), policy=policy.default))
+                self.reply("250 queued")
+            elif command in ("RSET", "NOOP"):
+                self.reply("250 ok")
+            elif command == "QUIT":
+                self.reply("221 bye")
+                return
+            else:
+                self.reply("502 not implemented")
+
+
+class DebugSMTPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address=("127.0.0.1", 1025)):
+        super().__init__(address, DebugSMTPHandler)
+        self.messages = []
+        self.connections = 0
+        self.lock = threading.Lock()
+
+    def process_request(self, request, client_address):
+        with self.lock:
+            self.connections += 1
+        super().process_request(request, client_address)
+
+    def deliver(self, recipients: list, message: EmailMessage):
+        with self.lock:
+            self.messages.append((recipients, message))
+        logger.info(f"Mail to {', '.join(recipients)}: {message['Subject']}\n{message.get_content()}")
+
+    # serves from a daemon thread, for tests
+    def start(self) -> "DebugSMTPServer":
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 1025
+    with DebugSMTPServer(("0.0.0.0", port)) as server:
+        logger.info(f"Debug SMTP listening on port {port}")
+        server.serve_forever()
@@ -0,0 +1,102 @@
+from io import BytesIO
+import os
+from typing import Optional
+import dotenv
+from PIL import Image
+
+from app.executor import SingleFlight, call_cpu
+from app.formats import VARIANT_FORMATS, encode_options, save_format_for, variant_key, variants_for
+from app.lru import DiskLRU
+from app.metrics import IMAGE_STAGE_SECONDS, timed
+from app.pipeline import resize_to_width
+from app.storage import storage
+
+dotenv.load_dotenv()
+
+# rendered by the worker in the same pass as the processed image
+DERIVATIVE_WIDTHS = tuple(int(w) for w in os.getenv("DERIVATIVE_WIDTHS", "128,512,1024").split(",") if w)
+# ?w= is rounded up to one of these, anything larger gets the full image
+RESPONSIVE_WIDTHS = tuple(sorted({int(w) for w in os.getenv("RESPONSIVE_WIDTHS", "128,256,512,1024,2048").split(",") if w} | set(DERIVATIVE_WIDTHS)))
+
+# widths the worker did not render are made on first request and kept on the api's disk
+DERIVATIVE_CACHE_DIR = os.getenv("DERIVATIVE_CACHE_DIR", "cache/derivatives")
+DERIVATIVE_CACHE_MAX_BYTES = int(os.getenv("DERIVATIVE_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+
+
+def responsive_width(width: int) -> Optional[int]:
+    for candidate in RESPONSIVE_WIDTHS:
+        if candidate >= width:
+            return candidate
+    return None
+
+
+def derivative_key(processed_key: str, width: int) -> str:
+    stem, ext = processed_key.split("/", 1)[1].rsplit(".", 1)
+    return f"derivatives/{stem}_w{width}.{ext}"
+
+
+def derivative_parent(key: str) -> str:
+    stem, ext = key.split("/", 1)[1].rsplit(".", 1)
+    return f"processed/{stem.rsplit('_w', 1)[0]}.{ext}"
+
+
+# every stored object that only exists for this processed image
+def companion_keys(processed_key: str) -> list:
+    keys = [processed_key] + [derivative_key(processed_key, width) for width in DERIVATIVE_WIDTHS]
+    return keys[1:] + [variant_key(key, ext) for key in keys for ext in VARIANT_FORMATS]
+
+
+def render_derivative(processed_key: str, width: int, save_format: str, options: dict) -> bytes:
+    with storage.read_path(processed_key) as path, Image.open(path) as image:
+        with timed(IMAGE_STAGE_SECONDS.labels("decode", image.format or "unknown")):
+            image.load()
+        with timed(IMAGE_STAGE_SECONDS.labels("resize", "lazy")):
+            resized = resize_to_width(image, width)
+
+        buffer = BytesIO()
+        with timed(IMAGE_STAGE_SECONDS.labels("encode", save_format)):
+            resized.save(buffer, format=save_format, **options)
+        return buffer.getvalue()
+
+
+derivative_cache = None
+renders = SingleFlight()
+
+
+def get_derivative_cache() -> DiskLRU:
+    global derivative_cache
+    if derivative_cache is None:
+        derivative_cache = DiskLRU(DERIVATIVE_CACHE_DIR, DERIVATIVE_CACHE_MAX_BYTES)
+    return derivative_cache
+
+
+# blocking, from sync handlers, concurrent requests for the same missing derivative share one render,
+# ext picks one of the processed image's variant formats, profile the encoder settings it was stored with
+def lazy_derivative(processed_key: str, width: int, ext: str, profile: Optional[str] = None) -> bytes:
+    key = derivative_key(processed_key, width)
+    primary_ext = key.rsplit(".", 1)[1]
+    if ext != primary_ext:
+        key = variant_key(key, ext)
+        save_format, options = variants_for(save_format_for(primary_ext), profile)[ext]
+    else:
+        save_format = save_format_for(ext)
+        options = encode_options(save_format, profile)
+
+    name = key.split("/", 1)[1].replace("/", "_")
+    cache = get_derivative_cache()
+
+    data = cache.get(name)
+    if data is not None:
+        return data
+
+    def load() -> bytes:
+        # a request that finished the render while this one waited for the flight
+        cached = cache.get(name)
+        if cached is not None:
+            return cached
+
+        rendered = call_cpu(render_derivative, processed_key, width, save_format, options)
+        cache.set(name, rendered)
+        return rendered
+
+    return renders.do(key, load)
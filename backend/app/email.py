@@ -1,9 +1,12 @@
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
+from email.message import EmailMessage
+import os
 import secrets
+import smtplib
+import ssl
+import threading
+import time
+from typing import Tuple
 from dotenv import load_dotenv
-import os
 
 from app.auth import create_verification_token
 
@@ -12,50 +15,109 @@ GMAIL_USER = os.getenv("GMAIL_USER")
 GMAIL_PASSWORD = os.getenv("GMAIL_PASSWORD")
 FRONTEND_URL = os.getenv("FRONTEND_URL")
 
-def send_email(to_email: str, subject: str, body: str):
-    print(GMAIL_USER)
-    msg = MIMEMultipart()
-    msg['From'] = GMAIL_USER
-    msg['To'] = to_email
-    msg['Subject'] = subject
+# gmail by default, point at the debug server (python -m app.debug_smtp) with SMTP_STARTTLS=false locally
+SMTP_HOST = os.getenv("SMTP_HOST", "smtp.gmail.com")
+SMTP_PORT = int(os.getenv("SMTP_PORT", "587"))
+SMTP_STARTTLS = os.getenv("SMTP_STARTTLS", "true").lower() == "true"
+SMTP_USER = os.getenv("SMTP_USER", GMAIL_USER)
+SMTP_PASSWORD = os.getenv("SMTP_PASSWORD", GMAIL_PASSWORD)
+EMAIL_FROM = os.getenv("EMAIL_FROM", SMTP_USER)
+SMTP_TIMEOUT = int(os.getenv("SMTP_TIMEOUT", "30"))
+# servers drop idle sessions and cap messages per session, a connection is replaced before either
+SMTP_MAX_IDLE_SECONDS = int(os.getenv("SMTP_MAX_IDLE_SECONDS", "60"))
+SMTP_MAX_MESSAGES = int(os.getenv("SMTP_MAX_MESSAGES", "100"))
+
 
-    msg.attach(MIMEText(body, 'plain'))
+def build_email(to_email: str, subject: str, body: str) -> EmailMessage:
+    msg = EmailMessage()
+    msg["From"] = EMAIL_FROM
+    msg["To"] = to_email
+    msg["Subject"] = subject
+    msg.set_content(body)
+    return msg
 
-    try:
-        with smtplib.SMTP('smtp.gmail.com', 587) as server:
-            server.starttls()
-            server.login(GMAIL_USER, GMAIL_PASSWORD)
 
-            server.sendmail(GMAIL_USER, to_email, msg.as_string())
+# one logged in session per worker process, reused by every message it sends
+class SMTPSender:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.server = None
+        self.sent = 0
+        self.last_used = 0.0
+
+    def connect(self) -> smtplib.SMTP:
+        server = smtplib.SMTP(SMTP_HOST, SMTP_PORT, timeout=SMTP_TIMEOUT)
+        try:
+            if SMTP_STARTTLS:
+                server.starttls(context=ssl.create_default_context())
+            if SMTP_USER and SMTP_PASSWORD:
+                server.login(SMTP_USER, SMTP_PASSWORD)
+        except Exception:
             server.close()
+            raise
+
+        self.sent = 0
+        return server
+
+    def close(self):
+        if self.server is not None:
+            try:
+                self.server.quit()
+            except (smtplib.SMTPException, OSError):
+                self.server.close()
+            self.server = None
+
+    def send(self, msg: EmailMessage):
+        with self.lock:
+            if self.server is not None and (self.sent >= SMTP_MAX_MESSAGES or time.monotonic() - self.last_used > SMTP_MAX_IDLE_SECONDS):
+                self.close()
+
+            # the server may close a reused session at any time, that is worth one fresh attempt
+            reused = self.server is not None
+            while True:
+                if self.server is None:
+                    self.server = self.connect()
 
-        return True
-    except Exception as e:
-        print(f"Failed to send email: {e}")
-        return False
-    
-def send_register_email(email: str, username: str):
+                try:
+                    self.server.send_message(msg)
+                    break
+                except smtplib.SMTPServerDisconnected:
+                    self.server = None
+                    if not reused:
+                        raise
+                    reused = False
+                except (smtplib.SMTPException, OSError):
+                    self.close()
+                    raise
+
+            self.sent += 1
+            self.last_used = time.monotonic()
+
+
+smtp_sender = SMTPSender()
+
+
+def send_email(to_email: str, subject: str, body: str):
+    smtp_sender.send(build_email(to_email, subject, body))
+
+
+# the message is composed in the request and sent by the email queue, returns (subject, body, code)
+def register_email(email: str, username: str) -> Tuple[str, str, str]:
     code = secrets.token_urlsafe(6)
 
     verification_token = create_verification_token(email, code)
 
     subject = "Welcome to RapidPic"
     body = f"Hello {username},\n\nThank you for registering on RapidPic Image Platform. Your verification link is: {FRONTEND_URL}/verify?token={verification_token}\n\nPlease verify your account within 15 minutes."
-    
-    return send_email(email, subject, body), code
 
-def send_password_reset_email(email: str, username: str):
+    return subject, body, code
+
+def password_reset_email(email: str, username: str) -> Tuple[str, str, str]:
     code = secrets.token_urlsafe(6)
 
-    verification_token = create_verification_token(email, code) 
+    verification_token = create_verification_token(email, code)
 
     subject = "RapidPic Password Reset Request"
     body = f"Hello {username},\n\nYou requested a password reset. Continue at the following link: {FRONTEND_URL}/reset-password?token={verification_token}\n\nThis link is valid for 15 minutes."
-    
-    return send_email(email, subject, body), code
-
-# def test_email():
-#     if send_register_email("blueblueblue@yahoo.com", "Blue"):
-#         print("Registration email sent successfully")
-#     else:
-#         print("Failed to send registration email")
+
+    return subject, body, code
@@ -0,0 +1,84 @@
+import asyncio
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import partial
+import os
+import threading
+import dotenv
+from fastapi import HTTPException
+
+dotenv.load_dotenv()
+
+# bcrypt and pil release the gil while they work, so threads are enough to use every core,
+# and keeping the pool at core count stops a login burst from starving the request threadpool
+CPU_POOL_SIZE = int(os.getenv("CPU_POOL_SIZE", os.cpu_count() or 1))
+
+cpu_executor = ThreadPoolExecutor(max_workers=CPU_POOL_SIZE, thread_name_prefix="cpu")
+
+# password hashing gets its own pool so a burst of logins or protected views cannot hold up
+# image renders, and a cap on queued hashes so the burst is turned away instead of piling up
+HASH_POOL_SIZE = int(os.getenv("HASH_POOL_SIZE", CPU_POOL_SIZE))
+HASH_QUEUE_LIMIT = int(os.getenv("HASH_QUEUE_LIMIT", HASH_POOL_SIZE * 8))
+
+hash_executor = ThreadPoolExecutor(max_workers=HASH_POOL_SIZE, thread_name_prefix="hash")
+hash_slots = threading.BoundedSemaphore(HASH_QUEUE_LIMIT)
+
+
+# from async handlers
+async def run_cpu(func, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(cpu_executor, partial(func, *args, **kwargs))
+
+
+# from sync handlers, which already run in the request threadpool
+def call_cpu(func, *args, **kwargs):
+    return cpu_executor.submit(func, *args, **kwargs).result()
+
+
+def submit_hash(func, *args) -> Future:
+    if not hash_slots.acquire(blocking=False):
+        raise HTTPException(status_code=503, detail="Server busy, please try again", headers={"Retry-After": "1"})
+
+    future = hash_executor.submit(func, *args)
+    future.add_done_callback(lambda _: hash_slots.release())
+    return future
+
+
+async def run_hash(func, *args):
+    return await asyncio.wrap_future(submit_hash(func, *args))
+
+
+def call_hash(func, *args):
+    return submit_hash(func, *args).result()
+
+
+# concurrent callers with the same key wait for the first one's result instead of repeating the work
+class SingleFlight:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+
+    def do(self, key, func):
+        with self.lock:
+            future = self.calls.get(key)
+            leader = future is None
+            if leader:
+                future = self.calls[key] = Future()
+
+        if not leader:
+            return future.result()
+
+        try:
+            result = func()
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+
+
+def shutdown_executors():
+    cpu_executor.shutdown(wait=False, cancel_futures=True)
+    hash_executor.shutdown(wait=False, cancel_futures=True)
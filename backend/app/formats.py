@@ -0,0 +1,96 @@
+import os
+from typing import Optional
+import dotenv
+from PIL import features
+
+dotenv.load_dotenv()
+
+# output extension -> pil format
+SAVE_FORMATS = {"png": "PNG", "jpg": "JPEG", "jpeg": "JPEG", "webp": "WEBP"}
+if features.check("avif"):
+    SAVE_FORMATS["avif"] = "AVIF"
+
+ALPHA_FORMATS = {"PNG", "WEBP", "AVIF"}
+
+# encoder settings per output profile, fast keeps encode time down, smallest spends it on bytes,
+# lossless webp uses quality as effort and gains nothing past balanced, see benchmarks/bench_encode.py
+PROFILES = {
+    "fast": {
+        "JPEG": {"quality": 85, "subsampling": 2},
+        "PNG": {"compress_level": 1},
+        "WEBP": {"quality": 80, "method": 0},
+        "WEBP_LOSSLESS": {"lossless": True, "quality": 0, "method": 0},
+        "AVIF": {"quality": 55, "speed": 10},
+    },
+    "balanced": {
+        "JPEG": {"quality": 85, "subsampling": 2, "optimize": True, "progressive": True},
+        "PNG": {"compress_level": 6},
+        "WEBP": {"quality": 80, "method": 4},
+        "WEBP_LOSSLESS": {"lossless": True, "quality": 50, "method": 2},
+        "AVIF": {"quality": 55, "speed": 8},
+    },
+    "smallest": {
+        "JPEG": {"quality": 80, "subsampling": 2, "optimize": True, "progressive": True},
+        "PNG": {"compress_level": 9},
+        "WEBP": {"quality": 75, "method": 6},
+        "WEBP_LOSSLESS": {"lossless": True, "quality": 50, "method": 2},
+        "AVIF": {"quality": 50, "speed": 6},
+    },
+}
+
+DEFAULT_PROFILE = os.getenv("DEFAULT_ENCODE_PROFILE", "balanced")
+
+# smaller copies the worker writes next to every output, lossless ones for png so its pixels stay exact
+VARIANTS = {
+    "JPEG": {"avif": "AVIF", "webp": "WEBP"},
+    "PNG": {"webp": "WEBP_LOSSLESS"},
+    "WEBP": {"avif": "AVIF"},
+}
+
+VARIANT_FORMATS = {ext for ext in os.getenv("VARIANT_FORMATS", "webp,avif").split(",") if ext in SAVE_FORMATS}
+
+
+def save_format_for(ext: str) -> str:
+    return SAVE_FORMATS.get(ext, "JPEG")
+
+
+# images stored before profiles existed have none and are reprocessed with the default
+def encode_options(encoder: str, profile: Optional[str] = None) -> dict:
+    return dict(PROFILES.get(profile or DEFAULT_PROFILE, PROFILES["balanced"]).get(encoder, {}))
+
+
+def variants_for(save_format: str, profile: Optional[str] = None) -> dict:
+    return {
+        ext: (encoder.split("_")[0], encode_options(encoder, profile))
+        for ext, encoder in VARIANTS.get(save_format, {}).items() if ext in VARIANT_FORMATS
+    }
+
+
+def variant_key(key: str, ext: str) -> str:
+    return f"variants/{key}.{ext}"
+
+
+def variant_parent(key: str) -> str:
+    return key[len("variants/"):].rsplit(".", 1)[0]
+
+
+# only types the client names explicitly count, image/* and */* are sent by clients that cannot decode avif
+def accepted_types(accept: Optional[str]) -> set:
+    types = set()
+    for part in (accept or "").split(","):
+        media_type, *params = [piece.strip() for piece in part.split(";")]
+        if any(param.replace(" ", "") in ("q=0", "q=0.0", "q=0.00", "q=0.000") for param in params):
+            continue
+        types.add(media_type.lower())
+    return types
+
+
+# the smallest stored format the client accepts, sizes maps extensions to bytes and always
+# includes the primary format once the worker recorded them
+def negotiate_format(accept: Optional[str], sizes: Optional[dict], primary_ext: str, mime_types: dict) -> str:
+    if not sizes:
+        return primary_ext
+
+    accepted = accepted_types(accept)
+    candidates = [ext for ext in sizes if ext == primary_ext or mime_types.get(ext) in accepted]
+    return min(candidates, key=lambda ext: sizes[ext], default=primary_ext)
@@ -0,0 +1,90 @@
+from datetime import datetime, timezone
+from email.utils import formatdate, parsedate_to_datetime
+import hashlib
+import json
+from typing import Optional, Tuple
+from fastapi import Request
+
+# processed outputs never change, but they are deleted once the image expires
+MAX_CACHE_AGE = 365 * 24 * 3600
+
+
+def image_etag(image_id: str, format: str, filters: Optional[list], width: Optional[int], height: Optional[int], variant: Optional[str] = None) -> str:
+    spec = [image_id, format, filters or [], width, height]
+    if variant:
+        spec.append(variant)
+
+    spec = json.dumps(spec, separators=(",", ":"))
+    return '"' + hashlib.sha256(spec.encode()).hexdigest()[:32] + '"'
+
+
+def http_date(timestamp: float) -> str:
+    return formatdate(timestamp, usegmt=True)
+
+
+def cache_max_age(expires_at: Optional[datetime]) -> int:
+    if not expires_at:
+        return MAX_CACHE_AGE
+
+    if expires_at.tzinfo is None:
+        expires_at = expires_at.replace(tzinfo=timezone.utc)
+
+    remaining = int((expires_at - datetime.now(timezone.utc)).total_seconds())
+    return max(0, min(MAX_CACHE_AGE, remaining))
+
+
+def public_cache_control(max_age: int) -> str:
+    return f"public, max-age={max_age}, immutable"
+
+
+# if-none-match wins over if-modified-since when both are sent (rfc 9110 13.2.2)
+def is_not_modified(request: Request, etag: str, last_modified: float) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        if if_none_match.strip() == "*":
+            return True
+
+        # weak comparison, a W/ prefix from an intermediary still matches
+        tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        return etag in tags
+
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+
+        if since.tzinfo is None:
+            since = since.replace(tzinfo=timezone.utc)
+
+        return int(last_modified) <= since.timestamp()
+
+    return False
+
+
+# (first, last) of a single byte range, None when the whole object should be sent: no or an
+# unsupported range, several ranges, or an if-range that no longer matches the client's copy
+def requested_range(request: Request, etag: Optional[str] = None, last_modified: Optional[str] = None) -> Optional[Tuple[Optional[int], Optional[int]]]:
+    header = request.headers.get("range")
+    if not header:
+        return None
+
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+
+    if_range = request.headers.get("if-range")
+    if if_range is not None and if_range.strip() not in (etag, last_modified):
+        return None
+
+    first, sep, last = spec.strip().partition("-")
+    if not sep or not (first.isdigit() or first == "") or not (last.isdigit() or last == ""):
+        return None
+
+    first = int(first) if first else None
+    last = int(last) if last else None
+    if first is None and last is None or first is not None and last is not None and last < first:
+        return None
+
+    return first, last
@@ -0,0 +1,173 @@
+from dataclasses import asdict, dataclass
+from datetime import datetime, timezone
+import json
+import logging
+import os
+from typing import Optional
+import dotenv
+import redis
+from sqlalchemy.orm import Session
+
+from app.blobs import image_processed_key
+from app.lru import LocalLRU
+from app.models import Blob, Image as ImageModel
+from app.redis_client import redis_client
+from app.storage import storage
+
+dotenv.load_dotenv()
+
+LOCAL_CACHE_SIZE = int(os.getenv("IMAGE_CACHE_LOCAL_SIZE", "4096"))
+LOCAL_CACHE_TTL = int(os.getenv("IMAGE_CACHE_LOCAL_TTL", "60"))
+REDIS_CACHE_TTL = int(os.getenv("IMAGE_CACHE_REDIS_TTL", "600"))
+# an unfinished entry may be read before the worker commits and written after it invalidated,
+# so it only absorbs a burst of polls and can never hide the completion for long
+REDIS_PENDING_TTL = int(os.getenv("IMAGE_CACHE_REDIS_PENDING_TTL", "2"))
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class ImageMeta:
+    id: str
+    format: str
+    filters: Optional[list]
+    width: Optional[int]
+    height: Optional[int]
+    protected: bool
+    status: str
+    expires_at: Optional[datetime]
+    processed_key: str
+    # when the processed object was stored, only known once processing completed
+    last_modified: Optional[float]
+    # bytes per stored format, none for images processed before variants existed
+    variants: Optional[dict] = None
+    encode_profile: Optional[str] = None
+    # pixel width of the processed image, none when it was processed before this was recorded
+    pixel_width: Optional[int] = None
+
+    @property
+    def ext(self) -> str:
+        return self.format.lower().strip()
+
+    def is_expired(self) -> bool:
+        return self.expires_at is not None and self.expires_at < datetime.now(timezone.utc)
+
+    def to_json(self) -> str:
+        data = asdict(self)
+        data["expires_at"] = self.expires_at.isoformat() if self.expires_at else None
+        return json.dumps(data)
+
+    @classmethod
+    def from_json(cls, raw) -> "ImageMeta":
+        data = json.loads(raw)
+        data["expires_at"] = datetime.fromisoformat(data["expires_at"]) if data["expires_at"] else None
+        return cls(**data)
+
+
+def meta_from_model(image_model: ImageModel, variants: Optional[dict] = None, pixel_width: Optional[int] = None) -> ImageMeta:
+    ext = image_model.format.lower().strip()
+    key = image_processed_key(image_model.id, ext, image_model.processed_key)
+
+    expires_at = image_model.expires_at
+    if expires_at is not None and expires_at.tzinfo is None:
+        expires_at = expires_at.replace(tzinfo=timezone.utc)
+
+    last_modified = storage.last_modified(key) if image_model.status == "COMPLETED" else None
+
+    return ImageMeta(
+        id=image_model.id,
+        format=image_model.format,
+        filters=image_model.filters,
+        width=image_model.width,
+        height=image_model.height,
+        protected=bool(image_model.protected),
+        status=image_model.status,
+        expires_at=expires_at,
+        processed_key=key,
+        last_modified=last_modified,
+        variants=variants,
+        encode_profile=image_model.encode_profile,
+        pixel_width=pixel_width,
+    )
+
+
+local_cache = LocalLRU(LOCAL_CACHE_SIZE, LOCAL_CACHE_TTL)
+
+
+def redis_key(image_id: str) -> str:
+    return f"image_meta:{image_id}"
+
+
+def redis_ttl(meta: ImageMeta) -> int:
+    ttl = REDIS_CACHE_TTL if meta.last_modified is not None else REDIS_PENDING_TTL
+    if not meta.expires_at:
+        return ttl
+
+    remaining = int((meta.expires_at - datetime.now(timezone.utc)).total_seconds())
+    return max(1, min(ttl, remaining))
+
+
+def remember(meta: ImageMeta):
+    # only finished images are immutable, so only those may sit in a per-process cache
+    # that the worker cannot reach, everything else is invalidated through redis
+    if meta.status == "COMPLETED" and meta.last_modified is not None:
+        local_cache.set(meta.id, meta)
+
+    try:
+        redis_client.set(redis_key(meta.id), meta.to_json(), ex=redis_ttl(meta))
+    except redis.RedisError as e:
+        logger.warning(f"Image cache write failed: {e}")
+
+
+# read through, local lru -> redis -> postgres
+def get_image_meta(db: Session, image_id: str) -> Optional[ImageMeta]:
+    meta = local_cache.get(image_id)
+
+    if meta is None:
+        try:
+            raw = redis_client.get(redis_key(image_id))
+        except redis.RedisError as e:
+            logger.warning(f"Image cache read failed: {e}")
+            raw = None
+
+        if raw is not None:
+            meta = ImageMeta.from_json(raw)
+            if meta.status == "COMPLETED" and meta.last_modified is not None:
+                local_cache.set(image_id, meta)
+
+    if meta is None:
+        image_model = db.query(ImageModel).filter_by(id=image_id).first()
+        if not image_model:
+            return None
+
+        variants, pixel_width = None, None
+        if image_model.processed_key and image_model.status == "COMPLETED":
+            blob = db.query(Blob.variants, Blob.width).filter_by(key=image_model.processed_key).first()
+            if blob:
+                variants, pixel_width = blob
+
+        meta = meta_from_model(image_model, variants, pixel_width)
+        remember(meta)
+
+    # the cleanup beat may not have deleted the row yet
+    if meta.is_expired():
+        return None
+
+    return meta
+
+
+def invalidate_images(image_ids: list):
+    if not image_ids:
+        return
+
+    for image_id in image_ids:
+        local_cache.delete(image_id)
+
+    try:
+        redis_client.delete(*[redis_key(image_id) for image_id in image_ids])
+    except redis.RedisError as e:
+        logger.warning(f"Image cache invalidation failed: {e}")
+
+
+def invalidate_image(image_id: str):
+    invalidate_images([image_id])
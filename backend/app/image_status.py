@@ -0,0 +1,113 @@
+import asyncio
+import json
+import logging
+import os
+from typing import Optional
+import dotenv
+import redis
+import redis.asyncio as aioredis
+
+from app.redis_client import REDIS_URL, redis_client
+
+dotenv.load_dotenv()
+
+STATUS_CHANNEL = "image_status"
+# a stream ends after this, EventSource reconnects on its own and the current status is re-read then
+STATUS_STREAM_TIMEOUT = int(os.getenv("STATUS_STREAM_TIMEOUT", "55"))
+STATUS_KEEPALIVE_SECONDS = 15
+STATUS_RECONNECT_SECONDS = 1
+
+logger = logging.getLogger(__name__)
+
+
+# worker side, a lost message only costs a waiting client its stream timeout
+def publish_statuses(image_ids: list, status: str):
+    if not image_ids:
+        return
+
+    try:
+        pipe = redis_client.pipeline(transaction=False)
+        for image_id in image_ids:
+            pipe.publish(STATUS_CHANNEL, json.dumps({"id": image_id, "status": status}))
+        pipe.execute()
+    except redis.RedisError as e:
+        logger.warning(f"Status publish failed: {e}")
+
+
+def publish_status(image_id: str, status: str):
+    publish_statuses([image_id], status)
+
+
+# one redis subscription per api process, fanned out to every waiting stream in memory
+class StatusHub:
+    def __init__(self):
+        self.waiters = {}
+        self.task = None
+
+    def subscribe(self, image_id: str) -> asyncio.Queue:
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self.listen())
+
+        queue = asyncio.Queue()
+        self.waiters.setdefault(image_id, set()).add(queue)
+        return queue
+
+    def unsubscribe(self, image_id: str, queue: asyncio.Queue):
+        queues = self.waiters.get(image_id)
+        if queues is not None:
+            queues.discard(queue)
+            if not queues:
+                del self.waiters[image_id]
+
+    def deliver(self, raw):
+        message = json.loads(raw)
+        for queue in self.waiters.get(message["id"], ()):
+            queue.put_nowait(message["status"])
+
+    async def listen(self):
+        while True:
+            client = aioredis.Redis.from_url(REDIS_URL)
+            try:
+                async with client.pubsub() as pubsub:
+                    await pubsub.subscribe(STATUS_CHANNEL)
+                    async for message in pubsub.listen():
+                        if message["type"] == "message":
+                            self.deliver(message["data"])
+            except (redis.RedisError, OSError) as e:
+                logger.warning(f"Status subscription failed: {e}")
+            finally:
+                await client.aclose()
+
+            await asyncio.sleep(STATUS_RECONNECT_SECONDS)
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+
+status_hub = StatusHub()
+
+
+def status_event(image_id: str, status: str) -> str:
+    return f"data: {json.dumps({'id': image_id, 'status': status})}\n\n"
+
+
+# yields the final status once, keepalive comments until then, nothing if the timeout passes first
+async def wait_for_status(queue: asyncio.Queue, timeout: float = STATUS_STREAM_TIMEOUT):
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+
+    while (remaining := deadline - loop.time()) > 0:
+        try:
+            status: Optional[str] = await asyncio.wait_for(queue.get(), min(STATUS_KEEPALIVE_SECONDS, remaining))
+        except asyncio.TimeoutError:
+            yield None
+            continue
+
+        yield status
+        return
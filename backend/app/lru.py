@@ -0,0 +1,116 @@
+from collections import OrderedDict
+import os
+import secrets
+import threading
+import time
+from typing import Optional
+
+
+class LocalLRU:
+    def __init__(self, max_size: int, ttl: int):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+
+            value, stored_at = entry
+            if time.monotonic() - stored_at > self.ttl:
+                del self.entries[key]
+                return None
+
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = (value, time.monotonic())
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+
+# files under root, least recently used removed first once they add up to more than max_bytes
+class DiskLRU:
+    def __init__(self, root: str, max_bytes: int):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.total = 0
+        self.lock = threading.Lock()
+
+        os.makedirs(root, exist_ok=True)
+
+        # recency from before a restart is approximated by mtime
+        files = []
+        with os.scandir(root) as entries:
+            for entry in entries:
+                if ".tmp-" in entry.name:
+                    os.remove(entry.path)
+                elif entry.is_file():
+                    stat = entry.stat()
+                    files.append((stat.st_mtime, entry.name, stat.st_size))
+
+        for _, name, size in sorted(files):
+            self.entries[name] = size
+            self.total += size
+
+        self.remove(self.evict())
+
+    def path(self, name: str) -> str:
+        return os.path.join(self.root, name)
+
+    def get(self, name: str) -> Optional[bytes]:
+        with self.lock:
+            if name not in self.entries:
+                return None
+            self.entries.move_to_end(name)
+
+        # read outside the lock, a file evicted in between is just a miss
+        try:
+            with open(self.path(name), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            with self.lock:
+                self.total -= self.entries.pop(name, 0)
+            return None
+
+    def set(self, name: str, data: bytes):
+        path = self.path(name)
+        tmp_path = f"{path}.tmp-{secrets.token_hex(4)}"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+        with self.lock:
+            self.total += len(data) - self.entries.get(name, 0)
+            self.entries[name] = len(data)
+            self.entries.move_to_end(name)
+            evicted = self.evict()
+
+        self.remove(evicted)
+
+    # called with the lock held, the files are removed after it is released
+    def evict(self) -> list:
+        evicted = []
+        while self.total > self.max_bytes and self.entries:
+            name, size = self.entries.popitem(last=False)
+            self.total -= size
+            evicted.append(name)
+        return evicted
+
+    def remove(self, names: list):
+        for name in names:
+            try:
+                os.remove(self.path(name))
+            except FileNotFoundError:
+                pass
@@ -1,17 +1,44 @@
 from fastapi import FastAPI, Request
+from fastapi.exception_handlers import request_validation_exception_handler
+from fastapi.exceptions import RequestValidationError
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, Response
+from fastapi.concurrency import run_in_threadpool
+import time
 from app.api import router
-from app.database import init_db
+from app.celery import QUEUES
+from app.database import DBPoolCollector, init_db
+from app.executor import shutdown_executors
+from app.image_status import status_hub
+from app.metrics import REQUEST_SECONDS, build_registry, render
+from app.task_metrics import TaskQueueCollector
+from app.uploads import MAX_BATCH_REQUEST_BYTES, MAX_UPLOAD_REQUEST_BYTES
+from app.validators import InvalidField
 from contextlib import asynccontextmanager
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     init_db()
     yield
+    await status_hub.stop()
+    shutdown_executors()
 
 
 app = FastAPI(lifespan=lifespan)
 
+metrics_registry = build_registry(DBPoolCollector(), TaskQueueCollector(QUEUES))
+
+
+# broken field rules keep the 400 with a readable detail the frontend shows, malformed bodies stay 422
+@app.exception_handler(RequestValidationError)
+async def invalid_field_handler(request: Request, exc: RequestValidationError):
+    for error in exc.errors():
+        cause = (error.get("ctx") or {}).get("error")
+        if isinstance(cause, InvalidField):
+            return JSONResponse(status_code=400, content={"detail": str(cause)})
+
+    return await request_validation_exception_handler(request, exc)
+
 
 # only https
 @app.middleware("http")
@@ -22,6 +49,51 @@ async def enforce_https(request: Request, call_next):
     return response
 
 
+# reject oversized uploads from the header, before the body is spooled
+@app.middleware("http")
+async def limit_upload_size(request: Request, call_next):
+    if request.url.path.startswith("/upload"):
+        batch = request.url.path.startswith("/upload/batch")
+        max_bytes = MAX_BATCH_REQUEST_BYTES if batch else MAX_UPLOAD_REQUEST_BYTES
+        content_length = request.headers.get("content-length")
+        if content_length and content_length.isdigit() and int(content_length) > max_bytes:
+            detail = "Batch exceeds the upload size limit" if batch else "File size exceeds 1MB limit"
+            return JSONResponse(status_code=413, content={"detail": detail})
+
+    return await call_next(request)
+
+
+@app.middleware("http")
+async def add_rate_limit_headers(request: Request, call_next):
+    response = await call_next(request)
+
+    result = getattr(request.state, "rate_limit", None)
+    if result:
+        response.headers.update(result.headers())
+
+    return response
+
+
+# time until the response starts, labelled by the matched route so every image id shares one series,
+# added last so it wraps the other middlewares and times them too
+@app.middleware("http")
+async def record_request_latency(request: Request, call_next):
+    start = time.perf_counter()
+    response = await call_next(request)
+
+    route = request.scope.get("route")
+    REQUEST_SECONDS.labels(request.method, route.path if route else "unmatched", response.status_code).observe(time.perf_counter() - start)
+
+    return response
+
+
+# scraped from inside the network, keep it off the public proxy
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    body, content_type = await run_in_threadpool(render, metrics_registry)
+    return Response(content=body, media_type=content_type)
+
+
 origins = [
        "https://rapidpic.marian.homes",
 ]
@@ -32,6 +104,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-RateLimit-Limit", "X-RateLimit-Remaining", "X-RateLimit-Reset", "Retry-After"],
 )
 
 app.include_router(router)
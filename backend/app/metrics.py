@@ -0,0 +1,68 @@
+import os
+import time
+from contextlib import contextmanager
+import dotenv
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Histogram, generate_latest, multiprocess, start_http_server
+
+# prefork celery children each write their own files here and the exporter in the main
+# process merges them, unset every process only reports what it observed itself,
+# the directory has to be empty when the process starts (a tmpfs in docker-compose.yml).
+# prometheus_client reads it on import, so it is read before .env like the library did
+PROMETHEUS_MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+
+dotenv.load_dotenv()
+
+# 0 turns the worker exporter off
+WORKER_METRICS_PORT = int(os.getenv("WORKER_METRICS_PORT", "9100"))
+
+# seconds, from sub millisecond cache hits up to slow image renders
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+# redis and most queries answer in well under a millisecond
+FAST_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1)
+# uploads are capped at 1 MB per file
+BYTES_BUCKETS = (10_000, 50_000, 100_000, 250_000, 500_000, 750_000, 1_000_000)
+
+# labelled by route template, never the raw path, so image ids don't create series
+REQUEST_SECONDS = Histogram("rapidpic_request_seconds", "Time until the response starts, per route", ["method", "route", "status"], buckets=LATENCY_BUCKETS)
+UPLOAD_BYTES = Histogram("rapidpic_upload_bytes", "Size of every uploaded file", ["format"], buckets=BYTES_BUCKETS)
+
+# stage is decode, resize, filter or encode, name the filter or the output format
+IMAGE_STAGE_SECONDS = Histogram("rapidpic_image_stage_seconds", "Time spent in each step of processing an image", ["stage", "name"], buckets=LATENCY_BUCKETS)
+
+# files on s3 count every key the cleanup asked to delete, whether the object existed or not
+CLEANUP_ROWS = Counter("rapidpic_cleanup_rows", "Images, users and files removed by the cleanup tasks", ["kind"])
+CLEANUP_BATCH_SECONDS = Histogram("rapidpic_cleanup_batch_seconds", "Time per cleanup batch", ["task"], buckets=LATENCY_BUCKETS)
+
+DB_QUERY_SECONDS = Histogram("rapidpic_db_query_seconds", "Time per executed statement", buckets=FAST_BUCKETS)
+DB_CHECKOUT_SECONDS = Histogram("rapidpic_db_checkout_seconds", "Time waited for a pooled connection", buckets=FAST_BUCKETS)
+REDIS_COMMAND_SECONDS = Histogram("rapidpic_redis_command_seconds", "Time per redis command or pipeline", ["command"], buckets=FAST_BUCKETS)
+
+
+@contextmanager
+def timed(histogram):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        histogram.observe(time.perf_counter() - start)
+
+
+# the collectors are read on every scrape, nothing is computed between scrapes
+def build_registry(*collectors) -> CollectorRegistry:
+    registry = REGISTRY
+    if PROMETHEUS_MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+
+    for collector in collectors:
+        registry.register(collector)
+    return registry
+
+
+def render(registry: CollectorRegistry) -> tuple:
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+def start_exporter(*collectors):
+    if WORKER_METRICS_PORT:
+        start_http_server(WORKER_METRICS_PORT, registry=build_registry(*collectors))
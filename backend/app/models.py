@@ -1,13 +1,16 @@
-from typing import Optional
+from typing import List, Optional
 from sqlalchemy import Column, Index, Integer, String, DateTime, JSON, Boolean
 from datetime import datetime, timezone, timedelta
 from app.database import Base
-from pydantic import BaseModel, EmailStr
+from pydantic import BaseModel
+from app.validators import Email, Password, Username
 
 mime_types = {
     "jpg": "image/jpeg",
     "jpeg": "image/jpeg",
     "png": "image/png",
+    "webp": "image/webp",
+    "avif": "image/avif",
 }
 
 class Image(Base):
@@ -23,8 +26,48 @@ class Image(Base):
     status = Column(String, default="PROCESSING")
     created_at = Column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc))
     expires_at = Column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc) + timedelta(days=7))
-
-    __table_args__ = (Index("ix_image_expires_at", "expires_at"),)
+    # content addressed blobs, null for images stored before dedup under their own id
+    original_key = Column(String, nullable=True)
+    processed_key = Column(String, nullable=True)
+    # encoder settings the outputs were written with, null for images stored before profiles
+    encode_profile = Column(String, nullable=True)
+    # the outbox state redispatch_stalled_images works from: when a message for the image last
+    # reached the broker, when a worker last started on it and how many times one did,
+    # null for images stored before these were tracked
+    dispatched_at = Column(DateTime(timezone=True), nullable=True)
+    started_at = Column(DateTime(timezone=True), nullable=True)
+    attempts = Column(Integer, nullable=True)
+
+    __table_args__ = (
+        Index("ix_image_expires_at", "expires_at"),
+        # only the rows /images/random can return, probed by id for random sampling
+        Index(
+            "ix_image_public_completed",
+            "id",
+            postgresql_where=(protected == False) & (status == "COMPLETED"),
+            sqlite_where=(protected == False) & (status == "COMPLETED"),
+        ),
+        # the few rows redispatch_stalled_images looks at
+        Index(
+            "ix_image_processing_created_at",
+            "created_at",
+            postgresql_where=(status == "PROCESSING"),
+            sqlite_where=(status == "PROCESSING"),
+        ),
+    )
+
+
+# stored files shared between images, deleted when the last image using them expires
+class Blob(Base):
+    __tablename__ = 'blobs'
+
+    key = Column(String, primary_key=True)
+    refcount = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc))
+    # processed blobs only, bytes per stored format, {"jpg": 80312, "webp": 13120}
+    variants = Column(JSON, nullable=True)
+    # processed blobs only, pixel width, null for blobs processed before it was recorded
+    width = Column(Integer, nullable=True)
 
 
 class User(Base):
@@ -52,30 +95,40 @@ class ImageUploadRequest(BaseModel):
     apply_blur: bool = False
     protected: bool = False
     password: Optional[str] = None
+    encode_profile: Optional[str] = None
 
 class RegisterRequest(BaseModel):
-    email: EmailStr
-    username: str
-    password: str
+    email: Email
+    username: Username
+    password: Password
 
 
 class LoginRequest(BaseModel):
-    email: EmailStr
-    password: str
+    email: Email
+    password: Password
 
 class VerifyRequest(BaseModel):
     token: str
 
 class PasswordResetEmailRequest(BaseModel):
-    email: EmailStr
+    email: Email
 
 class PasswordResetRequest(BaseModel):
-    new_password: str
+    new_password: Password
     token: str
 
 class UploadResponse(BaseModel):
     image_id: str
     message: str
 
+class BatchUploadItem(BaseModel):
+    filename: Optional[str] = None
+    image_id: Optional[str] = None
+    message: Optional[str] = None
+    error: Optional[str] = None
+
+class BatchUploadResponse(BaseModel):
+    items: List[BatchUploadItem]
+
 class MessageResponse(BaseModel):
     message: str
@@ -0,0 +1,238 @@
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+import os
+from typing import Optional, Tuple
+import numpy as np
+from PIL import Image, ImageFilter
+
+from app.formats import ALPHA_FORMATS, DEFAULT_PROFILE, variants_for
+from app.metrics import IMAGE_STAGE_SECONDS, timed
+
+FILTERS = ("grayscale", "color_inversion", "sepia", "blur")
+
+BLUR_RADIUS = 6
+
+INVERT_LUT = list(range(255, -1, -1))
+IDENTITY_LUT = list(range(256))
+
+# transposed once so every pixel row is multiplied as rgb @ SEPIA_T
+SEPIA_T = np.ascontiguousarray(np.array([[0.393, 0.769, 0.189],
+                                         [0.349, 0.686, 0.168],
+                                         [0.272, 0.534, 0.131]], dtype=np.float32).T)
+
+# rough milliseconds per megapixel on one core, measured on noisy rgb images so they err high
+DECODE_MS_PER_MP = 25
+RESIZE_MS_PER_MP = 10
+FILTER_MS_PER_MP = {"grayscale": 5, "color_inversion": 3, "sepia": 25, "blur": 60}
+ENCODE_MS_PER_MP = {"PNG": 100, "JPEG": 10, "WEBP": 150, "AVIF": 60}
+LOSSLESS_ENCODE_MS_PER_MP = {"WEBP": 500}
+# encode time of each profile against balanced, rounded from benchmarks/bench_encode.py
+PROFILE_ENCODE_SCALE = {"fast": 0.3, "balanced": 1.0, "smallest": 2.0}
+
+# modes each format stores as they are, everything else is processed as rgb or rgba
+NATIVE_MODES = {"PNG": ("L", "LA", "P"), "JPEG": ("L",)}
+
+# what pil raises for bytes it cannot decode or pixels it cannot transform
+DECODE_ERRORS = (OSError, SyntaxError, ValueError, Image.DecompressionBombError)
+
+
+# the image itself cannot be processed, the same bytes fail the same way on every attempt
+class UnprocessableImage(Exception):
+    pass
+
+
+# only around decoding and filtering, an OSError while encoding may just be a full disk
+@contextmanager
+def decoding(source_path: str):
+    try:
+        yield
+    except DECODE_ERRORS as e:
+        raise UnprocessableImage(f"{os.path.basename(source_path)}: {e}") from e
+
+
+@dataclass(frozen=True)
+class OperationPlan:
+    size: Optional[Tuple[int, int]]
+    filters: Tuple[str, ...]
+    save_format: str
+    profile: Optional[str] = None
+
+
+# one file written from the processed pixels, width shrinks it to at most that wide
+@dataclass(frozen=True)
+class Output:
+    path: str
+    format: str
+    width: Optional[int] = None
+    options: dict = field(default_factory=dict)
+
+
+def compile_plan(filters: list, width: int = 0, height: int = 0, save_format: str = "PNG", profile: Optional[str] = None) -> OperationPlan:
+    unknown = [f for f in filters if f not in FILTERS]
+    if unknown:
+        raise ValueError(f"Unknown filters: {unknown}")
+
+    size = (width, height) if width and height and width > 0 and height > 0 else None
+    return OperationPlan(size=size, filters=tuple(filters), save_format=save_format, profile=profile)
+
+
+# decode scales with the source, filters and encode with the output, every derivative narrower
+# than the output is resized from it and encoded in the same formats
+def estimate_cost_ms(filters: list, source_size: Tuple[int, int], target_size: Optional[Tuple[int, int]], save_format: str,
+                     profile: Optional[str] = None, derivative_widths: tuple = ()) -> float:
+    source_mp = source_size[0] * source_size[1] / 1e6
+    target_mp = target_size[0] * target_size[1] / 1e6 if target_size else source_mp
+    target_width = target_size[0] if target_size else source_size[0]
+
+    cost = source_mp * DECODE_MS_PER_MP
+    if target_size:
+        cost += source_mp * RESIZE_MS_PER_MP
+
+    encode_per_mp = ENCODE_MS_PER_MP.get(save_format, 0)
+    for variant_format, options in variants_for(save_format, profile).values():
+        rates = LOSSLESS_ENCODE_MS_PER_MP if options.get("lossless") else ENCODE_MS_PER_MP
+        encode_per_mp += rates.get(variant_format, 0)
+
+    encode_per_mp *= PROFILE_ENCODE_SCALE.get(profile or DEFAULT_PROFILE, 1.0)
+    cost += target_mp * (sum(FILTER_MS_PER_MP.get(f, 0) for f in filters) + encode_per_mp)
+
+    for width in derivative_widths:
+        if width < target_width:
+            cost += target_mp * RESIZE_MS_PER_MP + target_mp * (width / target_width) ** 2 * encode_per_mp
+    return cost
+
+
+def has_alpha(image: Image.Image) -> bool:
+    return "A" in image.getbands() or "transparency" in image.info
+
+
+# the source mode when the output format can store it and no step needs rgb, a grayscale
+# or palette png written as rgb is up to 3x larger for the same pixels
+def native_mode(plan: OperationPlan, image: Image.Image) -> Optional[str]:
+    if image.mode not in NATIVE_MODES.get(plan.save_format, ()):
+        return None
+
+    # palette indices and a transparent colour key only survive pixels that are left as they are
+    if image.mode == "P" or "transparency" in image.info:
+        return image.mode if not plan.filters and not plan.size else None
+
+    return image.mode if "sepia" not in plan.filters else None
+
+
+def run_plan(plan: OperationPlan, image: Image.Image) -> Image.Image:
+    mode = native_mode(plan, image)
+    keep_alpha = mode == "LA" if mode else plan.save_format in ALPHA_FORMATS and has_alpha(image)
+    base_mode = mode or ("RGBA" if keep_alpha else "RGB")
+
+    # jpeg can decode straight at 1/2, 1/4 or 1/8 scale, never below the target size
+    if plan.size and image.format == "JPEG":
+        image.draft(base_mode, plan.size)
+
+    # decoded here instead of inside the first convert, so the decode is timed on its own
+    with timed(IMAGE_STAGE_SECONDS.labels("decode", image.format or "unknown")):
+        image.load()
+
+    if image.mode != base_mode:
+        image = image.convert(base_mode)
+
+    if plan.size:
+        with timed(IMAGE_STAGE_SECONDS.labels("resize", "plan")):
+            image = image.resize(plan.size)
+
+    # pil handles resize/blur/grayscale/inversion natively, numpy handles the sepia math,
+    # and the buffer only crosses between the two when the next step needs it
+    array = None
+    for filter_name in plan.filters:
+        with timed(IMAGE_STAGE_SECONDS.labels("filter", filter_name)):
+            image, array = run_filter(filter_name, image, array, base_mode, keep_alpha)
+
+    if array is not None:
+        image = Image.fromarray(array)
+
+    return image
+
+
+# one step of the plan, array is the numpy buffer while consecutive steps stay in numpy
+def run_filter(filter_name: str, image: Image.Image, array, base_mode: str, keep_alpha: bool):
+    if filter_name != "sepia" and array is not None:
+        image = Image.fromarray(array)
+        array = None
+
+    if filter_name == "grayscale":
+        image = image.convert("LA" if keep_alpha else "L")
+    elif filter_name == "blur":
+        if keep_alpha:
+            alpha = image.getchannel("A")
+            image = image.filter(ImageFilter.GaussianBlur(radius=BLUR_RADIUS))
+            image.putalpha(alpha)
+        else:
+            image = image.filter(ImageFilter.GaussianBlur(radius=BLUR_RADIUS))
+    elif filter_name == "color_inversion":
+        # one lookup table per band, the alpha band maps to itself
+        bands = len(image.getbands())
+        lut = INVERT_LUT * (bands - 1) + IDENTITY_LUT if keep_alpha else INVERT_LUT * bands
+        image = image.point(lut)
+    elif filter_name == "sepia":
+        if array is None:
+            if image.mode in ("L", "LA"):
+                # sepia after grayscale needs the rgb channels back
+                image = image.convert(base_mode)
+            array = np.array(image)
+
+        # alpha stays in the last channel of the same buffer and is never touched
+        color = array[..., :-1] if keep_alpha else array
+
+        toned = color.astype(np.float32) @ SEPIA_T
+        np.clip(toned, 0, 255, out=toned)
+        color[...] = toned
+
+    return image, array
+
+
+# images already narrower than width are kept as they are
+def resize_to_width(image: Image.Image, width: int) -> Image.Image:
+    if image.width <= width:
+        return image
+
+    # pil only scales palette images with nearest neighbour
+    if image.mode == "P":
+        image = image.convert("RGBA" if has_alpha(image) else "RGB")
+
+    height = max(1, round(image.height * width / image.width))
+    return image.resize((width, height), Image.Resampling.LANCZOS, reducing_gap=3.0)
+
+
+# width of the processed image, only reads the source header when the plan keeps the size
+def output_width(plan: OperationPlan, source_path: str) -> int:
+    if plan.size:
+        return plan.size[0]
+
+    with decoding(source_path):
+        with Image.open(source_path) as source:
+            return source.width
+
+
+# the source is decoded once for every output, returns the size in bytes of each
+def execute_plan(plan: OperationPlan, source_path: str, outputs: list) -> list:
+    with decoding(source_path):
+        source = Image.open(source_path)
+
+    with source:
+        with decoding(source_path):
+            image = run_plan(plan, source)
+
+        resized = {}
+        sizes = []
+        for output in outputs:
+            target = image
+            if output.width:
+                if output.width not in resized:
+                    with timed(IMAGE_STAGE_SECONDS.labels("resize", "derivative")):
+                        resized[output.width] = resize_to_width(image, output.width)
+                target = resized[output.width]
+
+            with timed(IMAGE_STAGE_SECONDS.labels("encode", output.format)):
+                target.save(output.path, format=output.format, **output.options)
+            sizes.append(os.path.getsize(output.path))
+
+        return sizes
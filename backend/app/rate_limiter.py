@@ -1,23 +1,179 @@
+from collections import OrderedDict
+from dataclasses import dataclass
+import logging
+import math
 import os
-from fastapi import HTTPException
-import redis
+import threading
+import time
 import dotenv
+from fastapi import HTTPException, Request
+import redis
+
+from app.redis_client import redis_client
+
 dotenv.load_dotenv()
 
-REDIS_URL = os.getenv("REDIS_RATE_LIMIT_URL", "redis://localhost:6379/0")
+logger = logging.getLogger(__name__)
+
+# after redis fails, stay on the local buckets for a while instead of paying a timeout per request
+REDIS_RETRY_AFTER = 30
+LOCAL_MAX_KEYS = 10000
+
+
+@dataclass(frozen=True)
+class RateLimitPolicy:
+    name: str
+    # burst size, the bucket refills completely over period seconds
+    capacity: int
+    period: int
+
+
+@dataclass(frozen=True)
+class RateLimitResult:
+    policy: RateLimitPolicy
+    allowed: bool
+    remaining: int
+    reset: int
+    retry_after: int
+
+    def headers(self) -> dict:
+        headers = {
+            "X-RateLimit-Limit": str(self.policy.capacity),
+            "X-RateLimit-Remaining": str(self.remaining),
+            "X-RateLimit-Reset": str(self.reset),
+        }
+        if not self.allowed:
+            headers["Retry-After"] = str(self.retry_after)
+        return headers
+
+
+def load_policy(name: str, default: str) -> RateLimitPolicy:
+    # RATE_LIMIT_<NAME>=<capacity>/<period seconds>
+    capacity, period = os.getenv(f"RATE_LIMIT_{name.upper()}", default).split("/")
+    return RateLimitPolicy(name=name, capacity=int(capacity), period=int(period))
+
+
+POLICIES = {
+    "upload": load_policy("upload", "100/600"),
+    "login": load_policy("login", "10/300"),
+    "forgot_password": load_policy("forgot_password", "3/3600"),
+    "register": load_policy("register", "5/3600"),
+}
+
+
+# token bucket in one atomic round trip, the clock comes from redis so api nodes can't drift
+TOKEN_BUCKET_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local period = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local rate = capacity / period
+
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1])
+local ts = tonumber(state[2])
+if tokens == nil then
+    tokens = capacity
+    ts = now
+end
+
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+
+local allowed = 0
+if tokens >= cost then
+    tokens = tokens - cost
+    allowed = 1
+end
+
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+redis.call('PEXPIRE', KEYS[1], math.ceil(period * 1000))
+
+return {allowed, tostring(tokens), tostring((capacity - tokens) / rate), tostring(math.max(0, cost - tokens) / rate)}
+"""
+
+token_bucket = redis_client.register_script(TOKEN_BUCKET_SCRIPT)
+
+
+def make_result(policy: RateLimitPolicy, allowed: bool, tokens: float, reset: float, retry_after: float) -> RateLimitResult:
+    return RateLimitResult(
+        policy=policy,
+        allowed=allowed,
+        remaining=int(tokens),
+        reset=math.ceil(reset),
+        retry_after=math.ceil(retry_after),
+    )
+
+
+class LocalBuckets:
+    def __init__(self, max_keys: int):
+        self.max_keys = max_keys
+        self.buckets = OrderedDict()
+        self.lock = threading.Lock()
+
+    def take(self, key: str, policy: RateLimitPolicy, cost: int = 1) -> RateLimitResult:
+        rate = policy.capacity / policy.period
+        now = time.monotonic()
+
+        with self.lock:
+            tokens, ts = self.buckets.get(key, (policy.capacity, now))
+            tokens = min(policy.capacity, tokens + max(0, now - ts) * rate)
+
+            allowed = tokens >= cost
+            if allowed:
+                tokens -= cost
+
+            self.buckets[key] = (tokens, now)
+            self.buckets.move_to_end(key)
+            while len(self.buckets) > self.max_keys:
+                self.buckets.popitem(last=False)
+
+        return make_result(policy, allowed, tokens, (policy.capacity - tokens) / rate, max(0, cost - tokens) / rate)
+
+
+local_buckets = LocalBuckets(LOCAL_MAX_KEYS)
+redis_retry_at = 0.0
+
+
+def check(policy: RateLimitPolicy, uid: str, cost: int = 1) -> RateLimitResult:
+    global redis_retry_at
+
+    key = f"rate_limit:{policy.name}:{uid}"
+
+    # fail open to a per-process limit rather than failing every request
+    if time.monotonic() >= redis_retry_at:
+        try:
+            allowed, tokens, reset, retry_after = token_bucket(keys=[key], args=[policy.capacity, policy.period, cost])
+            return make_result(policy, bool(allowed), float(tokens), float(reset), float(retry_after))
+        except redis.RedisError as e:
+            logger.warning(f"Rate limiter falling back to local buckets: {e}")
+            redis_retry_at = time.monotonic() + REDIS_RETRY_AFTER
+
+    return local_buckets.take(key, policy, cost)
+
+
+def limit(request: Request, policy_name: str, uid: str, cost: int = 1):
+    result = check(POLICIES[policy_name], uid, cost)
+
+    # picked up by the add_rate_limit_headers middleware
+    request.state.rate_limit = result
+
+    if not result.allowed:
+        raise HTTPException(status_code=429, detail="Rate limit exceeded", headers=result.headers())
 
-redis_client = redis.Redis.from_url(REDIS_URL)
 
-def is_limited(uid: str, limit: int = 3, period: int = 3600) -> bool:
-    key = f"rate_limit:{uid}"
-    current = redis_client.get(key)
+def client_ip(request: Request) -> str:
+    # caddy appends the address it saw, so the last hop is the one to trust
+    forwarded = request.headers.get("x-forwarded-for")
+    if forwarded:
+        return forwarded.split(",")[-1].strip()
 
-    if current == 1:
-        redis_client.expire(key, period)
+    return request.client.host if request.client else "unknown"
 
-    return current > limit if current else False
 
-def limit(uid: str, limit: int = 100, period: int = 600) -> bool:
-    if is_limited(uid, limit, period):
-        raise HTTPException(status_code=429, detail="Rate limit exceeded")
+def limit_by_ip(policy_name: str):
+    def dependency(request: Request):
+        limit(request, policy_name, client_ip(request))
 
+    return dependency
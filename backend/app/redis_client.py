@@ -0,0 +1,39 @@
+import os
+import time
+import redis
+import dotenv
+
+from app.metrics import REDIS_COMMAND_SECONDS
+
+dotenv.load_dotenv()
+
+REDIS_URL = os.getenv("REDIS_RATE_LIMIT_URL", "redis://localhost:6379/0")
+
+# short timeouts, every caller has a fallback for when redis is unreachable
+REDIS_SOCKET_TIMEOUT = float(os.getenv("REDIS_SOCKET_TIMEOUT", "0.5"))
+
+
+# a pipeline is one round trip and is timed as one
+class TimedPipeline(redis.client.Pipeline):
+    def execute(self, raise_on_error=True):
+        start = time.perf_counter()
+        try:
+            return super().execute(raise_on_error)
+        finally:
+            REDIS_COMMAND_SECONDS.labels("PIPELINE").observe(time.perf_counter() - start)
+
+
+# every command, scripts included, goes through execute_command, failures and timeouts are timed too
+class TimedRedis(redis.Redis):
+    def execute_command(self, *args, **options):
+        start = time.perf_counter()
+        try:
+            return super().execute_command(*args, **options)
+        finally:
+            REDIS_COMMAND_SECONDS.labels(str(args[0]).upper()).observe(time.perf_counter() - start)
+
+    def pipeline(self, transaction=True, shard_hint=None) -> TimedPipeline:
+        return TimedPipeline(self.connection_pool, self.response_callbacks, transaction, shard_hint)
+
+
+redis_client = TimedRedis.from_url(REDIS_URL, socket_timeout=REDIS_SOCKET_TIMEOUT, socket_connect_timeout=REDIS_SOCKET_TIMEOUT)
@@ -0,0 +1,346 @@
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+import hashlib
+import os
+import secrets
+import tempfile
+from typing import Iterator, Optional, Tuple
+import dotenv
+
+dotenv.load_dotenv()
+
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "local")
+STORAGE_ROOT = os.getenv("STORAGE_ROOT", "storage")
+STORAGE_DELETE_WORKERS = int(os.getenv("STORAGE_DELETE_WORKERS", "8"))
+
+S3_BUCKET = os.getenv("S3_BUCKET")
+S3_PREFIX = os.getenv("S3_PREFIX", "")
+# minio or any other s3 compatible endpoint, unset for aws
+S3_ENDPOINT_URL = os.getenv("S3_ENDPOINT_URL")
+S3_REGION = os.getenv("S3_REGION")
+S3_MAX_POOL_CONNECTIONS = int(os.getenv("S3_MAX_POOL_CONNECTIONS", "32"))
+S3_MULTIPART_THRESHOLD = int(os.getenv("S3_MULTIPART_THRESHOLD", str(8 * 1024 * 1024)))
+
+# with a reverse proxy that serves STORAGE_ROOT itself, the api answers with an internal redirect
+# under this prefix instead of sending local files, empty to send them from python
+STORAGE_ACCEL_PREFIX = os.getenv("STORAGE_ACCEL_PREFIX", "").rstrip("/")
+
+STREAM_CHUNK_SIZE = 64 * 1024
+
+
+# a byte range that starts past the end of the object, size is its length for the 416 answer
+class RangeNotSatisfiable(Exception):
+    def __init__(self, size: int):
+        super().__init__(f"Range not satisfiable for {size} bytes")
+        self.size = size
+
+
+# (first, last) from a range header to inclusive offsets in an object of size bytes,
+# first None asks for the last `last` bytes, last None for everything from first on
+def resolve_range(first: Optional[int], last: Optional[int], size: int) -> Tuple[int, int]:
+    if first is None:
+        if not last or size == 0:
+            raise RangeNotSatisfiable(size)
+        return max(0, size - last), size - 1
+
+    if first >= size:
+        raise RangeNotSatisfiable(size)
+    return first, size - 1 if last is None else min(last, size - 1)
+
+
+# keys look like "originals/<name>" or "processed/<name>", drivers decide where the bytes live
+class Storage(ABC):
+    @abstractmethod
+    def exists(self, key: str) -> bool:
+        ...
+
+    @abstractmethod
+    def last_modified(self, key: str) -> Optional[float]:
+        ...
+
+    @abstractmethod
+    def put_bytes(self, key: str, data: bytes):
+        ...
+
+    # yields a local path to write to, the file is published under key only when the block succeeds
+    @abstractmethod
+    @contextmanager
+    def write_path(self, key: str) -> Iterator[str]:
+        ...
+
+    # yields a local path holding the object for the duration of the block
+    @abstractmethod
+    @contextmanager
+    def read_path(self, key: str) -> Iterator[str]:
+        ...
+
+    # a file the api can hand to FileResponse directly, None when the bytes are remote
+    def local_path(self, key: str) -> Optional[str]:
+        return None
+
+    # where the reverse proxy finds the file, None when it cannot serve it
+    def accel_uri(self, key: str) -> Optional[str]:
+        return None
+
+    @abstractmethod
+    def iter_chunks(self, key: str) -> Iterator[bytes]:
+        ...
+
+    # (start, end, size, chunks) for part of an object, see resolve_range for first and last
+    @abstractmethod
+    def open_range(self, key: str, first: Optional[int], last: Optional[int]) -> Tuple[int, int, int, Iterator[bytes]]:
+        ...
+
+    # the number of keys deleted, s3 reports a missing key as deleted too, so there it is the
+    # number of keys asked for that did not fail
+    @abstractmethod
+    def delete_many(self, keys: list) -> int:
+        ...
+
+    # (key, last modified) for every object under prefix
+    @abstractmethod
+    def list(self, prefix: str) -> Iterator[Tuple[str, float]]:
+        ...
+
+
+class LocalStorage(Storage):
+    def __init__(self, root: str):
+        self.root = root
+
+    # two levels of hash prefixed directories keep every directory small, md5 is only a layout hash
+    def sharded_path(self, key: str) -> str:
+        prefix, name = key.rsplit("/", 1)
+        digest = hashlib.md5(name.encode()).hexdigest()
+        return os.path.join(self.root, *prefix.split("/"), digest[:2], digest[2:4], name)
+
+    # files written before sharding live directly in the prefix directory
+    def flat_path(self, key: str) -> str:
+        return os.path.join(self.root, *key.split("/"))
+
+    def resolve(self, key: str) -> Optional[str]:
+        for path in (self.sharded_path(key), self.flat_path(key)):
+            if os.path.exists(path):
+                return path
+        return None
+
+    def exists(self, key: str) -> bool:
+        return self.resolve(key) is not None
+
+    def last_modified(self, key: str) -> Optional[float]:
+        for path in (self.sharded_path(key), self.flat_path(key)):
+            try:
+                return os.stat(path).st_mtime
+            except FileNotFoundError:
+                continue
+        return None
+
+    def put_bytes(self, key: str, data: bytes):
+        with self.write_path(key) as path:
+            with open(path, "wb") as f:
+                f.write(data)
+
+    # write then rename, readers never see a half written file and two writers of the same key
+    # just race on the rename
+    @contextmanager
+    def write_path(self, key: str) -> Iterator[str]:
+        path = self.sharded_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp-{secrets.token_hex(4)}"
+        try:
+            yield tmp_path
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    @contextmanager
+    def read_path(self, key: str) -> Iterator[str]:
+        path = self.resolve(key)
+        if path is None:
+            raise FileNotFoundError(key)
+        yield path
+
+    def local_path(self, key: str) -> Optional[str]:
+        return self.resolve(key)
+
+    def accel_uri(self, key: str) -> Optional[str]:
+        path = self.resolve(key) if STORAGE_ACCEL_PREFIX else None
+        if path is None:
+            return None
+        return f"{STORAGE_ACCEL_PREFIX}/{os.path.relpath(path, self.root).replace(os.sep, '/')}"
+
+    def iter_chunks(self, key: str) -> Iterator[bytes]:
+        with self.read_path(key) as path, open(path, "rb") as f:
+            while chunk := f.read(STREAM_CHUNK_SIZE):
+                yield chunk
+
+    def open_range(self, key: str, first: Optional[int], last: Optional[int]) -> Tuple[int, int, int, Iterator[bytes]]:
+        path = self.resolve(key)
+        if path is None:
+            raise FileNotFoundError(key)
+        size = os.path.getsize(path)
+        start, end = resolve_range(first, last, size)
+
+        def chunks():
+            with open(path, "rb") as f:
+                f.seek(start)
+                remaining = end - start + 1
+                while remaining > 0 and (chunk := f.read(min(STREAM_CHUNK_SIZE, remaining))):
+                    remaining -= len(chunk)
+                    yield chunk
+
+        return start, end, size, chunks()
+
+    def delete_one(self, key: str) -> bool:
+        removed = False
+        for path in (self.sharded_path(key), self.flat_path(key)):
+            try:
+                os.remove(path)
+                removed = True
+            except FileNotFoundError:
+                pass
+        return removed
+
+    def delete_many(self, keys: list) -> int:
+        if not keys:
+            return 0
+
+        with ThreadPoolExecutor(max_workers=STORAGE_DELETE_WORKERS) as pool:
+            return sum(pool.map(self.delete_one, keys))
+
+    def list(self, prefix: str) -> Iterator[Tuple[str, float]]:
+        base = os.path.join(self.root, *prefix.split("/"))
+        for directory, _, names in os.walk(base):
+            for name in names:
+                # in flight writes, abandoned ones are removed by the writer
+                if ".tmp-" in name:
+                    continue
+
+                try:
+                    mtime = os.stat(os.path.join(directory, name)).st_mtime
+                except FileNotFoundError:
+                    continue
+
+                yield f"{prefix}/{name}", mtime
+
+
+class S3Storage(Storage):
+    def __init__(self, bucket: str, prefix: str = "", endpoint_url: Optional[str] = None, region: Optional[str] = None):
+        import boto3
+        from boto3.s3.transfer import TransferConfig
+        from botocore.config import Config
+
+        self.bucket = bucket
+        self.prefix = prefix
+        # one client per process, its connection pool is shared by every thread
+        self.client = boto3.client(
+            "s3",
+            endpoint_url=endpoint_url,
+            region_name=region,
+            config=Config(max_pool_connections=S3_MAX_POOL_CONNECTIONS, retries={"max_attempts": 5, "mode": "adaptive"}),
+        )
+        self.transfer = TransferConfig(multipart_threshold=S3_MULTIPART_THRESHOLD, multipart_chunksize=S3_MULTIPART_THRESHOLD)
+
+    def object_key(self, key: str) -> str:
+        return f"{self.prefix}{key}"
+
+    def head(self, key: str) -> Optional[dict]:
+        from botocore.exceptions import ClientError
+
+        try:
+            return self.client.head_object(Bucket=self.bucket, Key=self.object_key(key))
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                return None
+            raise
+
+    def exists(self, key: str) -> bool:
+        return self.head(key) is not None
+
+    def last_modified(self, key: str) -> Optional[float]:
+        head = self.head(key)
+        return head["LastModified"].timestamp() if head else None
+
+    def put_bytes(self, key: str, data: bytes):
+        self.client.put_object(Bucket=self.bucket, Key=self.object_key(key), Body=data)
+
+    # objects only appear once the (multipart) upload completes, so this is atomic too
+    @contextmanager
+    def write_path(self, key: str) -> Iterator[str]:
+        fd, tmp_path = tempfile.mkstemp(suffix=os.path.splitext(key)[1])
+        os.close(fd)
+        try:
+            yield tmp_path
+            self.client.upload_file(tmp_path, self.bucket, self.object_key(key), Config=self.transfer)
+        finally:
+            os.remove(tmp_path)
+
+    @contextmanager
+    def read_path(self, key: str) -> Iterator[str]:
+        fd, tmp_path = tempfile.mkstemp(suffix=os.path.splitext(key)[1])
+        os.close(fd)
+        try:
+            self.client.download_file(self.bucket, self.object_key(key), tmp_path, Config=self.transfer)
+            yield tmp_path
+        finally:
+            os.remove(tmp_path)
+
+    def iter_chunks(self, key: str) -> Iterator[bytes]:
+        return self.stream_body(self.client.get_object(Bucket=self.bucket, Key=self.object_key(key))["Body"])
+
+    def stream_body(self, body) -> Iterator[bytes]:
+        try:
+            yield from body.iter_chunks(STREAM_CHUNK_SIZE)
+        finally:
+            body.close()
+
+    # one get, s3 resolves the range itself and reports what it sent in ContentRange
+    def open_range(self, key: str, first: Optional[int], last: Optional[int]) -> Tuple[int, int, int, Iterator[bytes]]:
+        from botocore.exceptions import ClientError
+
+        spec = f"bytes=-{last}" if first is None else f"bytes={first}-{'' if last is None else last}"
+        try:
+            response = self.client.get_object(Bucket=self.bucket, Key=self.object_key(key), Range=spec)
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") == "InvalidRange":
+                head = self.head(key)
+                raise RangeNotSatisfiable(head["ContentLength"] if head else 0)
+            raise
+
+        # "bytes 0-99/1234", absent when the object is empty and s3 ignored the range
+        content_range = response.get("ContentRange")
+        if not content_range:
+            response["Body"].close()
+            raise RangeNotSatisfiable(response["ContentLength"])
+
+        span, _, size = content_range.removeprefix("bytes ").partition("/")
+        start, _, end = span.partition("-")
+        return int(start), int(end), int(size), self.stream_body(response["Body"])
+
+    def delete_many(self, keys: list) -> int:
+        deleted = 0
+        # delete_objects takes at most 1000 keys per call
+        for start in range(0, len(keys), 1000):
+            chunk = keys[start:start + 1000]
+            response = self.client.delete_objects(
+                Bucket=self.bucket,
+                Delete={"Objects": [{"Key": self.object_key(key)} for key in chunk], "Quiet": True},
+            )
+            deleted += len(chunk) - len(response.get("Errors", []))
+        return deleted
+
+    def list(self, prefix: str) -> Iterator[Tuple[str, float]]:
+        paginator = self.client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self.object_key(prefix + "/")):
+            for item in page.get("Contents", []):
+                yield item["Key"][len(self.prefix):], item["LastModified"].timestamp()
+
+
+def create_storage() -> Storage:
+    if STORAGE_BACKEND == "s3":
+        return S3Storage(S3_BUCKET, S3_PREFIX, S3_ENDPOINT_URL, S3_REGION)
+    return LocalStorage(STORAGE_ROOT)
+
+
+storage = create_storage()
@@ -0,0 +1,89 @@
+import logging
+import os
+import redis
+from prometheus_client.core import GaugeMetricFamily, HistogramMetricFamily
+
+from app.redis_client import REDIS_SOCKET_TIMEOUT, TimedRedis, redis_client
+
+# seconds, cumulative like prometheus buckets
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# the celery redis transport keeps each queue as a list named after it
+broker_client = TimedRedis.from_url(
+    os.getenv("CELERY_BROKER_URL", "redis://localhost:6379/0"), socket_timeout=REDIS_SOCKET_TIMEOUT, socket_connect_timeout=REDIS_SOCKET_TIMEOUT
+)
+
+logger = logging.getLogger(__name__)
+
+
+def stats_key(queue: str) -> str:
+    return f"task_stats:{queue}"
+
+
+# aggregated in redis so every worker process, on any host, adds to the same numbers
+def record_task(queue: str, wait: float, run: float):
+    logger.info(f"Task on {queue}: waited {wait * 1000:.1f} ms, ran {run * 1000:.1f} ms")
+
+    key = stats_key(queue)
+    try:
+        pipe = redis_client.pipeline(transaction=False)
+        pipe.hincrby(key, "count", 1)
+        pipe.hincrbyfloat(key, "wait_sum", wait)
+        pipe.hincrbyfloat(key, "run_sum", run)
+        for bucket in LATENCY_BUCKETS:
+            if wait <= bucket:
+                pipe.hincrby(key, f"wait_le_{bucket}", 1)
+            if run <= bucket:
+                pipe.hincrby(key, f"run_le_{bucket}", 1)
+        pipe.execute()
+    except redis.RedisError as e:
+        logger.warning(f"Task stats write failed: {e}")
+
+
+def get_queue_stats(queues: list) -> dict:
+    pipe = redis_client.pipeline(transaction=False)
+    for queue in queues:
+        pipe.hgetall(stats_key(queue))
+
+    return {
+        queue: {field.decode(): float(value) for field, value in raw.items()}
+        for queue, raw in zip(queues, pipe.execute())
+    }
+
+
+def get_queue_depths(queues: list) -> dict:
+    pipe = broker_client.pipeline(transaction=False)
+    for queue in queues:
+        pipe.llen(queue)
+    return dict(zip(queues, pipe.execute()))
+
+
+# read when /metrics is scraped, the histograms are the cluster wide ones record_task keeps
+class TaskQueueCollector:
+    def __init__(self, queues: list):
+        self.queues = queues
+
+    # nothing to declare up front, registering would otherwise read redis at import
+    def describe(self):
+        return []
+
+    def collect(self):
+        try:
+            depths = get_queue_depths(self.queues)
+            stats = get_queue_stats(self.queues)
+        except redis.RedisError as e:
+            logger.warning(f"Task stats read failed: {e}")
+            return
+
+        depth = GaugeMetricFamily("rapidpic_queue_depth", "Messages waiting in each celery queue", labels=["queue"])
+        for queue, count in depths.items():
+            depth.add_metric([queue], count)
+        yield depth
+
+        for phase, help_text in (("wait", "Time from enqueue to task start"), ("run", "Time a task ran")):
+            histogram = HistogramMetricFamily(f"rapidpic_task_{phase}_seconds", help_text, labels=["queue"])
+            for queue, fields in stats.items():
+                buckets = [(str(bucket), fields.get(f"{phase}_le_{bucket}", 0.0)) for bucket in LATENCY_BUCKETS]
+                buckets.append(("+Inf", fields.get("count", 0.0)))
+                histogram.add_metric([queue], buckets, fields.get(f"{phase}_sum", 0.0))
+            yield histogram
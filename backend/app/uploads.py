@@ -0,0 +1,53 @@
+from io import BytesIO
+from typing import Optional, Tuple
+from fastapi import HTTPException, UploadFile
+from PIL import Image
+
+from app.formats import encode_options
+from app.storage import storage
+
+MAX_UPLOAD_BYTES = 1000000
+UPLOAD_CHUNK_SIZE = 64 * 1024
+
+# room for the multipart boundaries and the options form field
+MAX_UPLOAD_REQUEST_BYTES = MAX_UPLOAD_BYTES + 64 * 1024
+
+MAX_BATCH_FILES = 20
+MAX_BATCH_REQUEST_BYTES = MAX_BATCH_FILES * MAX_UPLOAD_REQUEST_BYTES
+
+
+async def read_upload(file: UploadFile, max_bytes: int = MAX_UPLOAD_BYTES) -> bytes:
+    if file.size is not None and file.size > max_bytes:
+        raise HTTPException(status_code=413, detail="File size exceeds 1MB limit")
+
+    buffer = bytearray()
+    while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+        buffer.extend(chunk)
+        if len(buffer) > max_bytes:
+            raise HTTPException(status_code=413, detail="File size exceeds 1MB limit")
+
+    return bytes(buffer)
+
+
+# only parses the header, the pixel data is never decoded here
+def probe_image(content: bytes) -> Optional[Tuple[str, str, Tuple[int, int]]]:
+    try:
+        with Image.open(BytesIO(content)) as image:
+            return image.format, image.mode, image.size
+    except Exception:
+        return None
+
+
+# blocking, meant to be run in the cpu pool, a blob that is already stored is left as is
+def store_original(content: bytes, key: str, save_format: str, source_format: str, profile: Optional[str] = None):
+    if storage.exists(key):
+        return
+
+    if source_format == save_format:
+        storage.put_bytes(key, content)
+        return
+
+    with Image.open(BytesIO(content)) as image, storage.write_path(key) as path:
+        if save_format == "JPEG" and image.mode != "RGB":
+            image = image.convert("RGB")
+        image.save(path, format=save_format, **encode_options(save_format, profile))
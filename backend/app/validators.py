@@ -1,35 +1,49 @@
 import re
-from fastapi import HTTPException
-
-
-
-def validate_email(email: str):
-    regex = re.compile(r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$')
-
-    if not regex.match(email):
-        raise HTTPException(status_code=400, detail="Invalid email format")
-
-def validate_username(username: str):
-    regex = re.compile(r'^[0-9A-Za-z]{6,16}$')
-
-    if not regex.match(username):
-        raise HTTPException(
-            status_code=400, 
-            detail="Username must be 6-16 characters long, letters and digits only"
-        )
-
-
-def validate_password(password: str):
-    pattern = re.compile(r'^(?=.*?[A-Z])(?=.*?[a-z])(?=.*?[0-9])(?=.*?[#?!@$%^&*-]).{8,}$')
-    if not pattern.match(password):
-        raise HTTPException(
-            status_code=400,
-            detail=(
-                "Password must have at least 8 characters and include:\n"
-                "- At least 1 uppercase letter\n"
-                "- At least 1 lowercase letter\n"
-                "- At least 1 digit\n"
-                "- At least 1 special character (#?!@$%^&*-)"
-            )
-        )
-
+from typing import Annotated
+from pydantic import AfterValidator
+
+# compiled once at import, the request models below run them on every auth request
+EMAIL_PATTERN = re.compile(r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$')
+USERNAME_PATTERN = re.compile(r'^[0-9A-Za-z]{6,16}$')
+PASSWORD_PATTERN = re.compile(r'^(?=.*?[A-Z])(?=.*?[a-z])(?=.*?[0-9])(?=.*?[#?!@$%^&*-]).{8,}$')
+
+PASSWORD_RULES = (
+    "Password must have at least 8 characters and include:\n"
+    "- At least 1 uppercase letter\n"
+    "- At least 1 lowercase letter\n"
+    "- At least 1 digit\n"
+    "- At least 1 special character (#?!@$%^&*-)"
+)
+
+
+# a rule the client broke, answered as a 400 with this message as the detail
+class InvalidField(ValueError):
+    pass
+
+
+# the domain is lowercased like EmailStr did, so stored addresses keep matching
+def validate_email(email: str) -> str:
+    email = email.strip()
+    if not EMAIL_PATTERN.match(email):
+        raise InvalidField("Invalid email format")
+    local, _, domain = email.rpartition("@")
+    return f"{local}@{domain.lower()}"
+
+def validate_username(username: str) -> str:
+    username = username.strip()
+    if not USERNAME_PATTERN.match(username):
+        raise InvalidField("Username must be 6-16 characters long, letters and digits only")
+    return username
+
+
+def validate_password(password: str) -> str:
+    password = password.strip()
+    if not PASSWORD_PATTERN.match(password):
+        raise InvalidField(PASSWORD_RULES)
+    return password
+
+
+# request model fields, stripped and checked in the one pydantic pass over the body
+Email = Annotated[str, AfterValidator(validate_email)]
+Username = Annotated[str, AfterValidator(validate_username)]
+Password = Annotated[str, AfterValidator(validate_password)]
@@ -0,0 +1,80 @@
+# p50/p99 latency of cheap requests while logins hash passwords concurrently,
+# with bcrypt called inline from async handlers (before) and through the cpu pool (after)
+# run from backend/: python -m benchmarks.bench_concurrency
+import asyncio
+import statistics
+import time
+import httpx
+from fastapi import FastAPI
+from passlib.context import CryptContext
+
+from app.executor import call_cpu, shutdown_executors
+
+# open loop arrivals per second, latency is measured from the scheduled arrival
+# so time spent waiting on a blocked event loop is counted
+LOGIN_RATE = 2
+PING_RATE = 100
+DURATION = 5
+
+pass_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+HASHED = pass_context.hash("Password1!")
+
+
+def build_app(mode: str) -> FastAPI:
+    app = FastAPI()
+
+    if mode == "before":
+        @app.post("/login")
+        async def login():
+            return {"ok": pass_context.verify("Password1!", HASHED)}
+    else:
+        @app.post("/login")
+        def login():
+            return {"ok": call_cpu(pass_context.verify, "Password1!", HASHED)}
+
+    @app.get("/ping")
+    async def ping():
+        return {"ok": True}
+
+    return app
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+async def run(mode: str):
+    transport = httpx.ASGITransport(app=build_app(mode))
+    latencies = {"login": [], "ping": []}
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        async def call(kind, arrival):
+            await asyncio.sleep(max(0, arrival - time.perf_counter()))
+            if kind == "login":
+                await client.post("/login")
+            else:
+                await client.get("/ping")
+            latencies[kind].append(time.perf_counter() - arrival)
+
+        start = time.perf_counter()
+        arrivals = [("login", start + i / LOGIN_RATE) for i in range(LOGIN_RATE * DURATION)]
+        arrivals += [("ping", start + i / PING_RATE) for i in range(PING_RATE * DURATION)]
+
+        await asyncio.gather(*(call(kind, arrival) for kind, arrival in arrivals))
+        total = time.perf_counter() - start
+
+    for kind, values in latencies.items():
+        print(f"{mode:>7} {kind:>6} p50 {statistics.median(values) * 1000:>8.1f} ms  "
+              f"p99 {percentile(values, 99) * 1000:>8.1f} ms")
+    print(f"{mode:>7} total {total:.2f} s for {len(arrivals)} requests")
+
+
+def main():
+    for mode in ("before", "after"):
+        asyncio.run(run(mode))
+    shutdown_executors()
+
+
+if __name__ == "__main__":
+    main()
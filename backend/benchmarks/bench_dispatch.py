@@ -0,0 +1,137 @@
+# upload to COMPLETED latency through the real api and a real worker, with the old fixed
+# countdown (before) and dispatch on commit (after), against a throwaway sqlite database
+# and storage directory that are deleted afterwards
+# run from backend/: python -m benchmarks.bench_dispatch
+import asyncio
+from io import BytesIO
+import json
+import os
+import secrets
+import shutil
+import statistics
+import tempfile
+import time
+import httpx
+from celery.contrib.testing.worker import start_worker
+from PIL import Image
+
+# set before the app modules read them, .env never overrides what is already in the environment
+BENCH_DIR = tempfile.mkdtemp(prefix="bench_dispatch_")
+os.environ.update({
+    "DATABASE_URL": f"sqlite:///{os.path.join(BENCH_DIR, 'bench.db')}",
+    "STORAGE_BACKEND": "local",
+    "STORAGE_ROOT": os.path.join(BENCH_DIR, "storage"),
+    "DERIVATIVE_CACHE_DIR": os.path.join(BENCH_DIR, "cache"),
+    "STORAGE_ACCEL_PREFIX": "",
+})
+
+from app.auth import create_email_token
+from app.celery import PROCESS_QUEUES, celery_app, process_image_task
+from app.database import SessionLocal, engine, init_db
+from app.main import app
+from app.models import Image as ImageModel, User
+
+UPLOADS = 10
+UPLOAD_INTERVAL = 0.2
+COUNTDOWN = 5
+POLL_INTERVAL = 0.01
+
+OPTIONS = json.dumps({"format": "png", "apply_grayscale": True})
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def sample_png() -> bytes:
+    # random pixels so no upload reuses another one's processed blob
+    buffer = BytesIO()
+    Image.frombytes("RGB", (256, 256), secrets.token_bytes(256 * 256 * 3)).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def bench_user() -> str:
+    db = SessionLocal()
+    email = f"bench-{secrets.token_hex(4)}@example.com"
+    db.add(User(email=email, username=f"bench{secrets.token_hex(4)}", hashed_password="x", verified=True))
+    db.commit()
+    db.close()
+    return create_email_token(email)
+
+
+def completed_at(image_ids: set, finished: dict):
+    db = SessionLocal()
+    try:
+        done = db.query(ImageModel.id).filter(ImageModel.id.in_(image_ids), ImageModel.status == "COMPLETED").all()
+        for (image_id,) in done:
+            finished.setdefault(image_id, time.perf_counter())
+    finally:
+        db.close()
+
+
+async def run(token: str) -> list:
+    started = {}
+    finished = {}
+
+    async def upload_all():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", cookies={"access_token": token}) as client:
+            for _ in range(UPLOADS):
+                start = time.perf_counter()
+                response = await client.post("/upload", files={"file": ("bench.png", sample_png(), "image/png")}, data={"options": OPTIONS})
+                response.raise_for_status()
+                started[response.json()["image_id"]] = start
+                await asyncio.sleep(UPLOAD_INTERVAL)
+
+    # polled while uploads are still going so completion is seen as it happens
+    uploads = asyncio.create_task(upload_all())
+    deadline = time.perf_counter() + UPLOADS * UPLOAD_INTERVAL + COUNTDOWN * 4
+    while not uploads.done() or len(finished) < len(started):
+        if time.perf_counter() > deadline:
+            break
+
+        pending = set(started) - set(finished)
+        if pending:
+            await asyncio.to_thread(completed_at, pending, finished)
+        await asyncio.sleep(POLL_INTERVAL)
+
+    await uploads
+    return [finished[image_id] - started[image_id] for image_id in finished]
+
+
+def report(mode: str, latencies: list):
+    print(f"{mode:7} completed {len(latencies)}/{UPLOADS}  "
+          f"p50 {percentile(latencies, 50) * 1000:8.1f} ms  p99 {percentile(latencies, 99) * 1000:8.1f} ms  "
+          f"mean {statistics.mean(latencies) * 1000:8.1f} ms")
+
+
+def main():
+    try:
+        bench()
+    finally:
+        engine.dispose()
+        shutil.rmtree(BENCH_DIR, ignore_errors=True)
+
+
+def bench():
+    init_db()
+    token = bench_user()
+
+    # the in memory transport polls, keep its interval well below the latencies measured
+    celery_app.conf.update(broker_url="memory://", result_backend="cache+memory://", task_always_eager=False,
+                           broker_transport_options={"polling_interval": POLL_INTERVAL})
+    dispatch = process_image_task.apply_async
+
+    with start_worker(celery_app, pool="solo", perform_ping_check=False, queues=PROCESS_QUEUES + ["celery"]):
+        for mode in ("before", "after"):
+            if mode == "before":
+                process_image_task.apply_async = lambda *args, **kwargs: dispatch(*args, countdown=COUNTDOWN, **kwargs)
+            else:
+                process_image_task.apply_async = dispatch
+
+            report(mode, asyncio.run(run(token)))
+
+
+if __name__ == "__main__":
+    main()
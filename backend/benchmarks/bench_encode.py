@@ -0,0 +1,71 @@
+# encode time against file size for every output profile on a fixed generated corpus
+# run from backend/: python -m benchmarks.bench_encode
+import os
+import tempfile
+import time
+import numpy as np
+from PIL import Image, ImageFilter
+
+from app.formats import PROFILES, SAVE_FORMATS, encode_options
+
+SIZE = 1280
+REPEATS = 3
+# the formats images are processed to plus the encoders their variants use
+ENCODERS = ["JPEG", "PNG", "WEBP", "WEBP_LOSSLESS"] + (["AVIF"] if "avif" in SAVE_FORMATS else [])
+
+
+# seeded so every run encodes the same pixels, a smooth photo like image with fine grain,
+# a flat graphic with hard edges and the worst case of pure noise
+def make_corpus():
+    rng = np.random.default_rng(SIZE)
+    y, x = np.mgrid[0:SIZE, 0:SIZE].astype(np.float32) / SIZE
+    smooth = np.stack([x * 200 + 30, y * 180 + 40, (1 - x) * 120 + y * 90], axis=-1)
+    photo = Image.fromarray(np.clip(smooth + rng.normal(0, 6, smooth.shape), 0, 255).astype(np.uint8)).filter(ImageFilter.GaussianBlur(1))
+
+    graphic = Image.new("RGB", (SIZE, SIZE), (245, 245, 240))
+    blocks = rng.integers(0, SIZE, (40, 4))
+    colors = rng.integers(0, 256, (40, 3))
+    for (x0, y0, x1, y1), color in zip(blocks, colors):
+        graphic.paste(tuple(int(c) for c in color), (int(min(x0, x1)), int(min(y0, y1)), int(max(x0, x1)), int(max(y0, y1))))
+
+    noise = Image.fromarray(rng.integers(0, 256, (SIZE, SIZE, 3), dtype=np.uint8))
+    return {"photo": photo, "graphic": graphic, "noise": noise}
+
+
+def encode(image, path, encoder, profile):
+    best = float("inf")
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        image.save(path, format=encoder.split("_")[0], **encode_options(encoder, profile))
+        best = min(best, time.perf_counter() - start)
+    return best, os.path.getsize(path)
+
+
+def main():
+    corpus = make_corpus()
+    print(f"{SIZE}x{SIZE} images, best of {REPEATS}")
+    print(f"{'encoder':>14} {'image':>8} " + " ".join(f"{profile + ' ms':>14} {profile + ' KB':>14}" for profile in PROFILES))
+
+    totals = {encoder: {profile: [0.0, 0] for profile in PROFILES} for encoder in ENCODERS}
+    with tempfile.TemporaryDirectory() as root:
+        path = os.path.join(root, "out")
+        for encoder in ENCODERS:
+            for name, image in corpus.items():
+                row = []
+                for profile in PROFILES:
+                    seconds, size = encode(image, path, encoder, profile)
+                    totals[encoder][profile][0] += seconds
+                    totals[encoder][profile][1] += size
+                    row.append(f"{seconds * 1000:14.1f} {size / 1024:14.1f}")
+                print(f"{encoder:>14} {name:>8} " + " ".join(row))
+
+    # relative to balanced, the profile multipliers in the cost model come from these
+    print()
+    print(f"{'encoder':>14} " + " ".join(f"{profile + ' time':>16} {profile + ' size':>16}" for profile in PROFILES))
+    for encoder, by_profile in totals.items():
+        seconds, size = by_profile["balanced"]
+        print(f"{encoder:>14} " + " ".join(f"{t / seconds:16.2f} {s / size:16.2f}" for t, s in by_profile.values()))
+
+
+if __name__ == "__main__":
+    main()
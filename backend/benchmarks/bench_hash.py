@@ -0,0 +1,71 @@
+# password verify throughput per core for each hashing setup, and the access grant check that
+# replaces it for repeat views of a protected image, needs SECRET_KEY and ALGORITHM like the api
+# run from backend/: python -m benchmarks.bench_hash
+from concurrent.futures import ThreadPoolExecutor
+import os
+import time
+from passlib.context import CryptContext
+from passlib.exc import MissingBackendError
+from starlette.requests import Request
+
+from app.auth import IMAGE_GRANT_COOKIE, create_image_grant, has_image_grant
+
+PASSWORD = "correct horse battery staple"
+DURATION = 2.0
+# (name, CryptContext options)
+SETUPS = [
+    ("bcrypt rounds=10", {"schemes": ["bcrypt"], "bcrypt__rounds": 10}),
+    ("bcrypt rounds=12", {"schemes": ["bcrypt"], "bcrypt__rounds": 12}),
+    ("argon2 t=2 m=19MiB", {"schemes": ["argon2"], "argon2__time_cost": 2, "argon2__memory_cost": 19456, "argon2__parallelism": 1}),
+    ("argon2 t=3 m=64MiB", {"schemes": ["argon2"], "argon2__time_cost": 3, "argon2__memory_cost": 65536, "argon2__parallelism": 1}),
+]
+
+
+# verifies per second on one thread and spread over every core
+def throughput(verify, threads: int) -> float:
+    def loop():
+        count = 0
+        deadline = time.perf_counter() + DURATION
+        while time.perf_counter() < deadline:
+            verify()
+            count += 1
+        return count
+
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        start = time.perf_counter()
+        counts = list(pool.map(lambda _: loop(), range(threads)))
+        return sum(counts) / (time.perf_counter() - start)
+
+
+def grant_request(token: str) -> Request:
+    cookie = f"{IMAGE_GRANT_COOKIE}={token}".encode()
+    return Request({"type": "http", "method": "GET", "path": "/", "headers": [(b"cookie", cookie)]})
+
+
+def main():
+    cores = os.cpu_count() or 1
+    print(f"{cores} cores, {DURATION:.0f}s per measurement")
+    print(f"{'setup':>20} {'ms/verify':>10} {'verify/s 1 thread':>18} {'verify/s all cores':>19} {'per core':>9}")
+
+    for name, options in SETUPS:
+        context = CryptContext(**options)
+        try:
+            hashed = context.hash(PASSWORD)
+        except MissingBackendError:
+            print(f"{name:>20}  skipped, backend not installed")
+            continue
+
+        verify = lambda: context.verify(PASSWORD, hashed)
+        single = throughput(verify, 1)
+        parallel = throughput(verify, cores)
+        print(f"{name:>20} {1000 / single:10.1f} {single:18.1f} {parallel:19.1f} {parallel / cores:9.1f}")
+
+    request = grant_request(create_image_grant("bench"))
+    verify = lambda: has_image_grant(request, "bench")
+    single = throughput(verify, 1)
+    parallel = throughput(verify, cores)
+    print(f"{'image grant':>20} {1000 / single:10.3f} {single:18.1f} {parallel:19.1f} {parallel / cores:9.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+# compares the fused operation plan against the old per-filter path
+# run from backend/: python -m benchmarks.bench_pipeline
+import time
+import numpy as np
+from PIL import Image, ImageFilter
+
+from app.pipeline import compile_plan, run_plan
+
+SIZES = [256, 640, 1280, 2560]
+# (name, filters, resize to half)
+CASES = [
+    ("resize", [], True),
+    ("grayscale", ["grayscale"], False),
+    ("color_inversion", ["color_inversion"], False),
+    ("sepia", ["sepia"], False),
+    ("blur", ["blur"], False),
+]
+MODES = ["RGB", "RGBA"]
+REPEATS = 3
+
+
+# the pre-plan process_image_task body, kept here as the baseline
+def legacy_process(image, filters, width, height, save_format):
+    if width and height:
+        image = image.resize((width, height))
+
+    alpha = None
+    if image.mode == "RGBA" and save_format == "PNG":
+        alpha = image.split()[-1]
+        image = image.convert("RGB")
+
+    for filter_name in filters:
+        if filter_name == "grayscale":
+            image = image.convert("L")
+        elif filter_name == "color_inversion":
+            image_array = np.array(image)
+            image_array = 255 - image_array
+            image = Image.fromarray(image_array)
+        elif filter_name == "sepia":
+            image_array = np.array(image).astype(float)
+            sepia_matrix = np.array([[0.393, 0.769, 0.189],
+                                     [0.349, 0.686, 0.168],
+                                     [0.272, 0.534, 0.131]])
+
+            image_array = np.clip(image_array @ sepia_matrix.T, 0, 255).astype(np.uint8)
+            image = Image.fromarray(image_array)
+        elif filter_name == "blur":
+            image = image.filter(ImageFilter.GaussianBlur(radius=6))
+
+    if alpha:
+        image = image.convert("RGBA")
+        image.putalpha(alpha)
+
+    return image
+
+
+def make_image(size, mode):
+    rng = np.random.default_rng(size)
+    channels = len(mode)
+    return Image.fromarray(rng.integers(0, 256, (size, size, channels), dtype=np.uint8), mode)
+
+
+def best_of(fn):
+    best = float("inf")
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    print(f"{'size':>6} {'mode':>5} {'case':>16} {'legacy ms':>10} {'plan ms':>10} {'speedup':>8}")
+    for size in SIZES:
+        for mode in MODES:
+            source = make_image(size, mode)
+            for name, filters, resize in CASES:
+                width, height = (size // 2, size // 2) if resize else (0, 0)
+                plan = compile_plan(filters, width, height, "PNG")
+
+                legacy = best_of(lambda: legacy_process(source.copy(), filters, width, height, "PNG").load())
+                fused = best_of(lambda: run_plan(plan, source.copy()).load())
+
+                print(f"{size:>6} {mode:>5} {name:>16} {legacy * 1000:>10.1f} {fused * 1000:>10.1f} {legacy / fused:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+# request parsing and validation cost of the auth endpoints, the old EmailStr models followed by the
+# regex validators in the handler against the single pass through the current request models,
+# per model and per request through a bare fastapi app, so no database or hashing is involved
+# needs email-validator for EmailStr: pip install -r benchmarks/requirements.txt
+# run from backend/: python -m benchmarks.bench_validation
+import asyncio
+import json
+import re
+import time
+from fastapi import FastAPI, HTTPException
+from pydantic import BaseModel, EmailStr
+
+from app.models import LoginRequest, PasswordResetEmailRequest, RegisterRequest
+
+ITERATIONS = 20000
+REQUESTS = 5000
+
+BODIES = {
+    "login": {"email": "someone@example.com", "password": "Passw0rd!x"},
+    "register": {"email": "someone@example.com", "username": "someone1", "password": "Passw0rd!x"},
+    "forgot-password": {"email": "someone@example.com"},
+}
+
+
+class LegacyRegisterRequest(BaseModel):
+    email: EmailStr
+    username: str
+    password: str
+
+
+class LegacyLoginRequest(BaseModel):
+    email: EmailStr
+    password: str
+
+
+class LegacyPasswordResetEmailRequest(BaseModel):
+    email: EmailStr
+
+
+# the pre-consolidation validators, compiled on every call
+def legacy_validate_email(email: str):
+    regex = re.compile(r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$')
+    if not regex.match(email):
+        raise HTTPException(status_code=400, detail="Invalid email format")
+
+
+def legacy_validate_username(username: str):
+    regex = re.compile(r'^[0-9A-Za-z]{6,16}$')
+    if not regex.match(username):
+        raise HTTPException(status_code=400, detail="Invalid username")
+
+
+def legacy_validate_password(password: str):
+    pattern = re.compile(r'^(?=.*?[A-Z])(?=.*?[a-z])(?=.*?[0-9])(?=.*?[#?!@$%^&*-]).{8,}$')
+    if not pattern.match(password):
+        raise HTTPException(status_code=400, detail="Invalid password")
+
+
+def legacy_login(data: LegacyLoginRequest):
+    legacy_validate_email(data.email.strip())
+    legacy_validate_password(data.password.strip())
+
+
+def legacy_register(data: LegacyRegisterRequest):
+    legacy_validate_email(data.email.strip())
+    legacy_validate_username(data.username.strip())
+    legacy_validate_password(data.password.strip())
+
+
+def legacy_forgot(data: LegacyPasswordResetEmailRequest):
+    legacy_validate_email(data.email.strip())
+
+
+# (legacy model, legacy handler checks, current model)
+CASES = {
+    "login": (LegacyLoginRequest, legacy_login, LoginRequest),
+    "register": (LegacyRegisterRequest, legacy_register, RegisterRequest),
+    "forgot-password": (LegacyPasswordResetEmailRequest, legacy_forgot, PasswordResetEmailRequest),
+}
+
+
+def make_app() -> FastAPI:
+    app = FastAPI()
+    for name, (legacy_model, legacy_checks, model) in CASES.items():
+        def legacy_route(data: legacy_model, checks=legacy_checks):
+            checks(data)
+            return {}
+
+        def route(data: model):
+            return {}
+
+        app.post(f"/legacy/{name}")(legacy_route)
+        app.post(f"/current/{name}")(route)
+    return app
+
+
+# one request straight through the asgi app, no client or network in the way
+async def call(app: FastAPI, path: str, body: bytes):
+    scope = {
+        "type": "http", "method": "POST", "path": path, "raw_path": path.encode(), "query_string": b"",
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+        "http_version": "1.1", "scheme": "http", "server": ("bench", 80), "client": ("127.0.0.1", 1), "root_path": "",
+    }
+    sent = False
+
+    async def receive():
+        nonlocal sent
+        if sent:
+            return {"type": "http.disconnect"}
+        sent = True
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    status = []
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            status.append(message["status"])
+
+    await app(scope, receive, send)
+    assert status == [200], status
+
+
+def per_call_us(fn, iterations: int) -> float:
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - start) / iterations * 1e6
+
+
+async def per_request_us(app: FastAPI, path: str, body: bytes) -> float:
+    for _ in range(100):
+        await call(app, path, body)
+    start = time.perf_counter()
+    for _ in range(REQUESTS):
+        await call(app, path, body)
+    return (time.perf_counter() - start) / REQUESTS * 1e6
+
+
+def main():
+    print(f"{'endpoint':>16} {'legacy model us':>16} {'model us':>10} {'legacy req us':>14} {'req us':>10} {'speedup':>8}")
+    app = make_app()
+    for name, (legacy_model, legacy_checks, model) in CASES.items():
+        raw = json.dumps(BODIES[name])
+        body = raw.encode()
+
+        legacy = per_call_us(lambda: legacy_checks(legacy_model.model_validate_json(raw)), ITERATIONS)
+        current = per_call_us(lambda: model.model_validate_json(raw), ITERATIONS)
+        legacy_request = asyncio.run(per_request_us(app, f"/legacy/{name}", body))
+        current_request = asyncio.run(per_request_us(app, f"/current/{name}", body))
+        print(f"{name:>16} {legacy:16.2f} {current:10.2f} {legacy_request:14.1f} {current_request:10.1f} {legacy_request / current_request:8.2f}")
+
+
+if __name__ == "__main__":
+    main()
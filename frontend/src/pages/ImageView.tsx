@@ -3,7 +3,7 @@
 import { useParams, useNavigate } from "react-router-dom";
 import { useCallback, useEffect, useState } from "react";
 import apiClient from "../api/ApiClient";
-import { copyToClipboard } from "../utils/utils";
+import { BACKEND_URL, copyToClipboard } from "../utils/utils";
 
 export default function ImageView() {
   const navigate = useNavigate();
@@ -15,17 +15,25 @@ export default function ImageView() {
   const [showPasswordPrompt, setShowPasswordPrompt] = useState<boolean>(false);
 
   const [imageBlob, setImageBlob] = useState<Blob | null>(null);
+  // set while the image is still processing, holds the password to retry with
+  const [waitingFor, setWaitingFor] = useState<{ pass?: string } | null>(
+    null,
+  );
 
   const fetchImage = useCallback(
     (pass?: string) => {
       if (!imageId) return;
 
-      apiClient
-        .post(
-          `/images/${imageId}`,
-          { password: pass || undefined },
-          { responseType: "blob" },
-        )
+      // public images go through the cacheable GET, the password only over POST
+      const request = pass
+        ? apiClient.post(
+            `/images/${imageId}`,
+            { password: pass },
+            { responseType: "blob" },
+          )
+        : apiClient.get(`/images/${imageId}`, { responseType: "blob" });
+
+      request
         .then((response) => {
           const blob = response.data;
           const url = URL.createObjectURL(blob);
@@ -46,7 +54,15 @@ export default function ImageView() {
             } else {
               const errorJson = JSON.parse(await error.response.data.text());
 
-              setError(errorJson.detail + ". Try reloading the page.");
+              if (errorJson.detail === "Image not processed yet") {
+                setWaitingFor({ pass });
+                setShowPasswordPrompt(false);
+                return;
+              }
+
+              if (errorJson.detail === "Image processing failed")
+                setError("Image processing failed. Try uploading it again.");
+              else setError(errorJson.detail + ". Try reloading the page.");
               setImageUrl("");
             }
           }
@@ -59,6 +75,27 @@ export default function ImageView() {
     fetchImage();
   }, [fetchImage]);
 
+  // the status stream sends one event once processing has finished
+  useEffect(() => {
+    if (!waitingFor || !imageId) return;
+
+    const source = new EventSource(`${BACKEND_URL}/images/${imageId}/status`, {
+      withCredentials: true,
+    });
+
+    source.onmessage = (event) => {
+      const { status } = JSON.parse(event.data);
+
+      source.close();
+      setWaitingFor(null);
+
+      if (status === "COMPLETED") fetchImage(waitingFor.pass);
+      else setError("Image processing failed. Try uploading it again.");
+    };
+
+    return () => source.close();
+  }, [waitingFor, imageId, fetchImage]);
+
   if (!imageId)
     return (
       <div className="container">
@@ -127,7 +164,7 @@ export default function ImageView() {
         <div className="card text-center">
           <div className="loading">
             <div className="spinner"></div>
-            Loading image...
+            {waitingFor ? "Processing image..." : "Loading image..."}
           </div>
         </div>
       </div>
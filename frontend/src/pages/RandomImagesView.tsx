@@ -2,33 +2,25 @@
 
 import { useEffect, useState } from "react";
 import apiClient from "../api/ApiClient";
+import { BACKEND_URL } from "../utils/utils";
 import { useNavigate } from "react-router-dom";
 
 export default function RandomImagesView() {
   const navigate = useNavigate();
 
   const [images, setImages] = useState<string[]>([]);
+  const [loaded, setLoaded] = useState<boolean>(false);
   const [error, setError] = useState<string>("");
 
   useEffect(() => {
     apiClient
       .get("/images/random")
-      .then(async (response) => {
+      .then((response) => {
         const imageIds = response.data as { id: string }[];
-        const urls: string[] = [];
 
-        for (const img of imageIds) {
-          const blobRes = await apiClient.post(
-            `/images/${img.id}`,
-            {},
-            { responseType: "blob" },
-          );
-
-          const url = URL.createObjectURL(blobRes.data);
-          urls.push(url);
-        }
-
-        setImages(urls);
+        // plain GET urls so the browser can cache and revalidate them
+        setImages(imageIds.map((img) => `${BACKEND_URL}/images/${img.id}`));
+        setLoaded(true);
       })
       .catch(() => setError("Could not fetch random images"));
   }, []);
@@ -47,17 +39,21 @@ export default function RandomImagesView() {
       <div className="card">
         <h1 className="title">Random Public Images</h1>
 
-        {images.length === 0 ? (
+        {!loaded ? (
           <div className="loading">
             <div className="spinner"></div>
             Loading images...
           </div>
+        ) : images.length === 0 ? (
+          <div className="message">No public images yet.</div>
         ) : (
           <div className="image-grid">
             {images.map((src, i) => (
               <img
                 key={i}
-                src={src}
+                src={`${src}?w=512`}
+                srcSet={`${src}?w=512 1x, ${src}?w=1024 2x`}
+                loading="lazy"
                 alt={`Random image ${i}`}
                 className="image-display"
               />
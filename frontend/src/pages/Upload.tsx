@@ -19,6 +19,7 @@ function FileUploadOptions({
 }) {
   const maxFileSize = 1000000; // ~ 1 MB
   const [format, setFormat] = useState<string>("PNG");
+  const [encodeProfile, setEncodeProfile] = useState<string>("balanced");
   const [applyResize, setApplyResize] = useState<boolean>(false);
   const [width, setWidth] = useState<number | "">("");
   const [height, setHeight] = useState<number | "">("");
@@ -49,6 +50,7 @@ function FileUploadOptions({
 
     const bodyData = {
       format: format,
+      encode_profile: encodeProfile,
       apply_resize: applyResize,
       width: applyResize && width !== "" ? width : undefined,
       height: applyResize && height !== "" ? height : undefined,
@@ -73,6 +75,7 @@ function FileUploadOptions({
           setFile(null);
 
           setFormat("PNG");
+          setEncodeProfile("balanced");
           setApplyResize(false);
           setWidth("");
           setHeight("");
@@ -111,6 +114,25 @@ function FileUploadOptions({
           <option value="PNG">PNG</option>
           <option value="JPG">JPG</option>
           <option value="JPEG">JPEG</option>
+          <option value="WEBP">WEBP</option>
+          <option value="AVIF">AVIF</option>
+        </select>
+      </div>
+
+      <div className="form-group">
+        <label htmlFor="encode-profile" className="form-label">
+          Compression:
+        </label>
+
+        <select
+          id="encode-profile"
+          value={encodeProfile}
+          onChange={(e) => setEncodeProfile(e.target.value)}
+          className="select"
+        >
+          <option value="fast">Fast</option>
+          <option value="balanced">Balanced</option>
+          <option value="smallest">Smallest</option>
         </select>
       </div>
 
@@ -0,0 +1,17 @@
+import os
+import sys
+import tempfile
+
+# the unit tests import the backend directly, tester.py talks to a running api instead
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "backend"))
+
+# a file, every pooled connection to an in-memory sqlite database would see its own empty one
+TEST_DIR = tempfile.mkdtemp()
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(TEST_DIR, 'test.db')}")
+os.environ.setdefault("STORAGE_ROOT", os.path.join(TEST_DIR, "storage"))
+os.environ.setdefault("SECRET_KEY", "test")
+os.environ.setdefault("ALGORITHM", "HS256")
+os.environ.setdefault("ACCESS_TOKEN_EXPIRE_MINUTES", "15")
+os.environ.setdefault("AWS_ACCESS_KEY_ID", "test")
+os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "test")
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
@@ -1,2 +1,3 @@
-pip install pytest && \
+pip install -r requirements.txt && \
+pytest test_storage.py test_email.py test_blobs.py && \
 pytest tester.py -s
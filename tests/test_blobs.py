@@ -0,0 +1,98 @@
+from datetime import datetime, timedelta, timezone
+import pytest
+
+from app.blobs import add_ref, release_refs, try_add_ref
+from app.celery import cleanup_expired_data
+from app.database import SessionLocal, init_db
+from app.models import Blob, Image as ImageModel
+from app.storage import storage
+
+ORIGINAL = "originals/shared.png"
+PROCESSED = "processed/shared.png"
+
+
+@pytest.fixture
+def db():
+    init_db()
+    session = SessionLocal()
+    yield session
+    session.rollback()
+    session.query(ImageModel).delete()
+    session.query(Blob).delete()
+    session.commit()
+    session.close()
+    storage.delete_many([ORIGINAL, PROCESSED])
+
+
+def refcount(db, key: str):
+    db.expire_all()
+    blob = db.get(Blob, key)
+    return blob.refcount if blob else None
+
+
+# what insert_images does for an upload whose original and output are already stored
+def add_image(db, image_id: str, expires_at: datetime):
+    db.add(ImageModel(id=image_id, format="png", status="COMPLETED", original_key=ORIGINAL, processed_key=PROCESSED, expires_at=expires_at))
+    add_ref(db, ORIGINAL)
+    add_ref(db, PROCESSED)
+    db.commit()
+
+
+def expire(db, image_id: str):
+    db.query(ImageModel).filter_by(id=image_id).update({"expires_at": datetime.now(timezone.utc) - timedelta(minutes=1)})
+    db.commit()
+
+
+def test_add_ref_counts_every_reference(db):
+    add_ref(db, ORIGINAL)
+    add_ref(db, ORIGINAL, 2)
+    db.commit()
+
+    assert refcount(db, ORIGINAL) == 3
+
+
+def test_try_add_ref_needs_a_stored_blob(db):
+    assert not try_add_ref(db, PROCESSED)
+
+    add_ref(db, PROCESSED)
+    assert try_add_ref(db, PROCESSED, 2)
+    db.commit()
+
+    assert refcount(db, PROCESSED) == 3
+
+
+def test_release_refs_returns_unreferenced_keys(db):
+    add_ref(db, ORIGINAL, 2)
+    add_ref(db, PROCESSED)
+    db.commit()
+
+    assert release_refs(db, [ORIGINAL, PROCESSED, None]) == [PROCESSED]
+    db.commit()
+    assert refcount(db, ORIGINAL) == 1
+    assert refcount(db, PROCESSED) is None
+
+    # a released blob is not revived by a late reuse, the upload stores it again instead
+    assert not try_add_ref(db, PROCESSED)
+    assert release_refs(db, [ORIGINAL, ORIGINAL]) == [ORIGINAL]
+
+
+def test_cleanup_keeps_shared_blobs_until_the_last_image(db):
+    storage.put_bytes(ORIGINAL, b"original")
+    storage.put_bytes(PROCESSED, b"processed")
+    later = datetime.now(timezone.utc) + timedelta(days=1)
+    add_image(db, "first", later)
+    add_image(db, "second", later)
+
+    expire(db, "first")
+    assert cleanup_expired_data()["images"] == 1
+    assert refcount(db, ORIGINAL) == 1
+    assert refcount(db, PROCESSED) == 1
+    assert storage.exists(ORIGINAL)
+    assert storage.exists(PROCESSED)
+
+    expire(db, "second")
+    assert cleanup_expired_data()["images"] == 1
+    assert refcount(db, ORIGINAL) is None
+    assert refcount(db, PROCESSED) is None
+    assert not storage.exists(ORIGINAL)
+    assert not storage.exists(PROCESSED)
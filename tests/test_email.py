@@ -0,0 +1,40 @@
+import pytest
+
+import app.email
+from app.celery import send_email_task
+from app.debug_smtp import DebugSMTPServer
+
+
+@pytest.fixture
+def smtp_server(monkeypatch):
+    server = DebugSMTPServer(("127.0.0.1", 0)).start()
+    monkeypatch.setattr(app.email, "SMTP_HOST", "127.0.0.1")
+    monkeypatch.setattr(app.email, "SMTP_PORT", server.server_address[1])
+    monkeypatch.setattr(app.email, "SMTP_STARTTLS", False)
+    monkeypatch.setattr(app.email, "EMAIL_FROM", "noreply@rapidpic.test")
+    monkeypatch.setattr(app.email, "smtp_sender", app.email.SMTPSender())
+    yield server
+    app.email.smtp_sender.close()
+    server.shutdown()
+    server.server_close()
+
+
+def send(count: int):
+    for i in range(count):
+        assert send_email_task.apply(args=(f"user{i}@rapidpic.test", f"Subject {i}", f"Body {i}")).get() is True
+
+
+def test_messages_share_one_connection(smtp_server):
+    send(5)
+
+    assert smtp_server.connections == 1
+    assert [recipients for recipients, _ in smtp_server.messages] == [[f"user{i}@rapidpic.test"] for i in range(5)]
+    assert [message["Subject"] for _, message in smtp_server.messages] == [f"Subject {i}" for i in range(5)]
+
+
+def test_connection_replaced_after_max_messages(smtp_server, monkeypatch):
+    monkeypatch.setattr(app.email, "SMTP_MAX_MESSAGES", 2)
+    send(5)
+
+    assert len(smtp_server.messages) == 5
+    assert smtp_server.connections == 3
@@ -0,0 +1,111 @@
+import os
+import boto3
+import pytest
+from moto import mock_aws
+
+from app.storage import LocalStorage, RangeNotSatisfiable, S3Storage, Storage
+
+
+# every test runs against both drivers, s3 through moto
+@pytest.fixture(params=["local", "s3"])
+def storage(request, tmp_path):
+    if request.param == "local":
+        yield LocalStorage(str(tmp_path))
+        return
+
+    with mock_aws():
+        boto3.client("s3", region_name="us-east-1").create_bucket(Bucket="rapidpic-test")
+        yield S3Storage("rapidpic-test", "prefix/", region="us-east-1")
+
+
+def read_range(storage, key, first, last):
+    start, end, size, chunks = storage.open_range(key, first, last)
+    return start, end, size, b"".join(chunks)
+
+
+def test_exists(storage):
+    storage.put_bytes("originals/a.png", b"data")
+
+    assert storage.exists("originals/a.png")
+    assert not storage.exists("originals/b.png")
+    assert storage.last_modified("originals/a.png") is not None
+    assert storage.last_modified("originals/b.png") is None
+
+
+def test_open_range(storage):
+    storage.put_bytes("originals/a.png", b"0123456789")
+
+    assert read_range(storage, "originals/a.png", 2, 4) == (2, 4, 10, b"234")
+    assert read_range(storage, "originals/a.png", 7, None) == (7, 9, 10, b"789")
+    assert read_range(storage, "originals/a.png", None, 3) == (7, 9, 10, b"789")
+    assert read_range(storage, "originals/a.png", 5, 100) == (5, 9, 10, b"56789")
+
+
+def test_open_range_not_satisfiable(storage):
+    storage.put_bytes("originals/a.png", b"0123456789")
+    storage.put_bytes("originals/empty.png", b"")
+
+    with pytest.raises(RangeNotSatisfiable) as e:
+        storage.open_range("originals/a.png", 10, None)
+    assert e.value.size == 10
+
+    with pytest.raises(RangeNotSatisfiable) as e:
+        storage.open_range("originals/empty.png", 0, None)
+    assert e.value.size == 0
+
+
+def test_write_path_publishes_on_success(storage):
+    with storage.write_path("processed/a.png") as path:
+        with open(path, "wb") as f:
+            f.write(b"partial")
+        # nothing is visible until the block is done
+        assert not storage.exists("processed/a.png")
+
+    assert storage.exists("processed/a.png")
+    assert b"".join(storage.iter_chunks("processed/a.png")) == b"partial"
+    assert not os.path.exists(path)
+
+
+def test_write_path_discards_on_failure(storage):
+    with pytest.raises(RuntimeError):
+        with storage.write_path("processed/a.png") as path:
+            with open(path, "wb") as f:
+                f.write(b"partial")
+            raise RuntimeError("encode failed")
+
+    assert not storage.exists("processed/a.png")
+    assert not os.path.exists(path)
+    assert list(storage.list("processed")) == []
+
+
+def test_list(storage):
+    storage.put_bytes("originals/a.png", b"a")
+    storage.put_bytes("originals/b.png", b"b")
+    storage.put_bytes("processed/a.png", b"a")
+
+    assert sorted(key for key, _ in storage.list("originals")) == ["originals/a.png", "originals/b.png"]
+    assert all(mtime > 0 for _, mtime in storage.list("originals"))
+
+
+def test_delete_many(storage):
+    storage.put_bytes("originals/a.png", b"a")
+    storage.put_bytes("originals/b.png", b"b")
+    storage.put_bytes("originals/c.png", b"c")
+
+    # s3 cannot tell a missing key from a deleted one without a request per key
+    missing = 1 if isinstance(storage, S3Storage) else 0
+    assert storage.delete_many(["originals/a.png", "originals/b.png", "originals/missing.png"]) == 2 + missing
+    assert not storage.exists("originals/a.png")
+    assert not storage.exists("originals/b.png")
+    assert storage.exists("originals/c.png")
+    assert storage.delete_many([]) == 0
+
+
+# a driver that misses part of the interface fails on creation, not in the middle of a request
+def test_incomplete_driver_fails_when_created():
+    class ExistsOnly(Storage):
+        def exists(self, key: str) -> bool:
+            return False
+
+    with pytest.raises(TypeError):
+        ExistsOnly()
@@ -22,7 +22,7 @@ def test_upload_large_file():
         data={"filter": "sepia"}
     )
 
-    assert response.status_code == 400
+    assert response.status_code == 413
     print("Test for large file passed.")
 
 def test_get_missing_file():